@@ -1,14 +1,14 @@
 import os
-import re
 import sys
 import json
-import time
 import asyncio
+import threading
 import qtawesome
 import subprocess
 from PyQt5 import QtCore, QtGui, QtWidgets
 from BiliVideoDownloader import BiliVideoDownloader
-from ffmpeg_manager import FFmpegManager, get_ffmpeg
+from bili_api import extract_bv_number, StreamSelector
+from ffmpeg_manager import get_ffmpeg, resolve_ffmpeg
 
 
 class EllipsisTableWidgetItem(QtWidgets.QTableWidgetItem):
@@ -39,6 +39,10 @@ class EllipsisTableWidgetItem(QtWidgets.QTableWidgetItem):
 class BiliDownloaderGUI(QtWidgets.QMainWindow):
     # 定义类级别的信号
     download_progress = QtCore.pyqtSignal(int, str)
+    # 后台合并完成（Future, 下载信息），由合并线程发出，在界面线程中处理
+    merge_finished = QtCore.pyqtSignal(object, object)
+    # 合集下载结束（保存的文件列表或异常, 下载信息），由下载线程发出，在界面线程中处理
+    collection_finished = QtCore.pyqtSignal(object, object)
 
     def __init__(self):
         # 首先调用父类的初始化
@@ -52,8 +56,23 @@ class BiliDownloaderGUI(QtWidgets.QMainWindow):
             # 如果没有找到图标文件，使用 qtawesome 的图标作为备选
             self.setWindowIcon(qtawesome.icon('fa.download', color='#4A90E2'))
 
+        # 编码偏好选项
+        self.codec_policies = {
+            "默认": StreamSelector(),
+            "体积最小": StreamSelector(prefer='smallest'),
+            "HEVC优先": StreamSelector(codecs=('hevc', 'avc')),
+            "AV1优先": StreamSelector(codecs=('av1', 'hevc', 'avc'))
+        }
         # 初始化所有实例变量
-        self.downloader = BiliVideoDownloader()
+        # 视频信息缓存写入用户目录，重启后未过期的条目可直接复用
+        self.downloader = BiliVideoDownloader(
+            cache_path=os.path.join(os.path.expanduser("~"), ".bilidownloader_cache.json"))
+        # 下载使用的事件循环在整个程序生命周期内复用，以便连接池跨任务保持
+        self.loop = asyncio.new_event_loop()
+        # 正在后台合并的临时文件名，合并结束前不能再次下载到同一组临时文件
+        self.merging = set()
+        # 合集在下载线程中进行时，下载器的状态（进度回调、失败列表等）被占用，不能开始新的下载
+        self.collection_running = False
         self.m_flag = False
         self.m_Position = None
         # 配置文件路径
@@ -84,6 +103,17 @@ class BiliDownloaderGUI(QtWidgets.QMainWindow):
 
         # 连接信号到更新函数
         self.download_progress.connect(self.update_progress)
+        self.merge_finished.connect(self.on_merge_finished)
+        self.collection_finished.connect(self.on_collection_finished)
+
+    def closeEvent(self, event):
+        """关闭窗口时释放连接池和事件循环"""
+        try:
+            self.loop.run_until_complete(self.downloader.close())
+            self.loop.close()
+        except Exception as e:
+            print(f"关闭下载器失败: {str(e)}")
+        super().closeEvent(event)
 
     def update_progress(self, value, status):
         """更新进度条和状态标签"""
@@ -110,18 +140,7 @@ class BiliDownloaderGUI(QtWidgets.QMainWindow):
 
     def extract_bv_number(self, input_str):
         """提取BV号"""
-        bv_pattern = re.compile(r'BV[a-zA-Z0-9]{10}')
-
-        # 检查输入是否是BV号
-        if bv_pattern.match(input_str):
-            return input_str
-
-        # 如果输入是链接，从链接中提取BV号
-        match = bv_pattern.search(input_str)
-        if match:
-            return match.group(0)
-
-        raise ValueError("输入的字符串中未找到有效的BV号")
+        return extract_bv_number(input_str)
 
     def cleanup_temp_files(self, temp_dir):
         """清理临时文件夹"""
@@ -316,12 +335,34 @@ class BiliDownloaderGUI(QtWidgets.QMainWindow):
         self.browse_button.setObjectName('browse_button')  # 添加对象名，用于样式设置
         self.browse_button.clicked.connect(self.browse_path)
 
+        # 编码偏好：同一清晰度下 HEVC/AV1 通常比 AVC 小 30%~50%，但旧播放器可能无法播放
+        self.codec_label = QtWidgets.QLabel('编码偏好:')
+        self.codec_combo = QtWidgets.QComboBox()
+        for name in self.codec_policies:
+            self.codec_combo.addItem(name)
+        self.codec_combo.setCurrentIndex(self.config.get('codec_policy', 0))
+
+        # 边下载边合并，只在支持命名管道的系统上可用
+        self.stream_mux_checkbox = QtWidgets.QCheckBox("边下载边合并（不写临时文件）")
+        self.stream_mux_checkbox.setEnabled(self.downloader.muxer.supported())
+        self.stream_mux_checkbox.setChecked(self.config.get('stream_mux', False) and self.downloader.muxer.supported())
+
+        # 分P选择，留空只下载P1
+        self.pages_label = QtWidgets.QLabel('分P:')
+        self.pages_input = QtWidgets.QLineEdit()
+        self.pages_input.setPlaceholderText("留空只下载P1，输入 all 下载全部，或如 1-3,5")
+
         # 设置下载选项布局
         options_layout.addWidget(self.quality_label, 0, 0)
         options_layout.addWidget(self.quality_combo, 0, 1, 1, 2)
-        options_layout.addWidget(self.path_label, 1, 0)
-        options_layout.addWidget(self.path_input, 1, 1, 1, 2)
-        options_layout.addWidget(self.browse_button, 1, 3)
+        options_layout.addWidget(self.codec_label, 1, 0)
+        options_layout.addWidget(self.codec_combo, 1, 1, 1, 2)
+        options_layout.addWidget(self.stream_mux_checkbox, 1, 3)
+        options_layout.addWidget(self.pages_label, 2, 0)
+        options_layout.addWidget(self.pages_input, 2, 1, 1, 2)
+        options_layout.addWidget(self.path_label, 3, 0)
+        options_layout.addWidget(self.path_input, 3, 1, 1, 2)
+        options_layout.addWidget(self.browse_button, 3, 3)
 
         # 进度条区域
         progress_widget = QtWidgets.QWidget()
@@ -848,9 +889,10 @@ class BiliDownloaderGUI(QtWidgets.QMainWindow):
     def check_ffmpeg(self):
         """检测是否已安装FFmpeg"""
         try:
-            ffmpeg_path = FFmpegManager().ensure_ffmpeg()
-            if ffmpeg_path:
-                QtWidgets.QMessageBox.information(self, "FFmpeg检测", f"系统已安装FFmpeg: {ffmpeg_path}")
+            ffmpeg = resolve_ffmpeg(refresh=True)
+            if ffmpeg:
+                QtWidgets.QMessageBox.information(
+                    self, "FFmpeg检测", f"系统已安装FFmpeg: {ffmpeg.path}\n版本：{ffmpeg.version}")
             else:
                 QtWidgets.QMessageBox.warning(self, "FFmpeg检测", "系统未安装FFmpeg")
         except Exception as e:
@@ -864,6 +906,68 @@ class BiliDownloaderGUI(QtWidgets.QMainWindow):
         except Exception as e:
             QtWidgets.QMessageBox.critical(self, "错误", f"下载安装FFmpeg时出错: {str(e)}")
 
+    def download_collection(self, bvid, save_path, quality, pages_text):
+        """下载多个分P：解析、下载、合并流水线并行，在下载线程中进行，完成后汇总失败的分P"""
+        page_count = len(self.downloader.video.get_info(bvid)['data']['pages'])
+        pages = self.downloader.parse_pages(pages_text, page_count)
+        if not pages:
+            QtWidgets.QMessageBox.warning(self, "警告", f"分P范围无效，该视频共 {page_count} P")
+            return
+
+        download_info = {
+            'quality': f"{self.quality_combo.currentText()}",
+            'save_path': save_path,
+            'bvid': bvid,
+            'page_count': len(pages)
+        }
+        # 合集可能要下载很久，不能在界面线程中运行事件循环；进度通过 download_progress 信号更新
+        self.collection_running = True
+        threading.Thread(target=self.run_collection, args=(bvid, save_path, quality, pages, download_info),
+                         daemon=True).start()
+
+    def run_collection(self, bvid, save_path, quality, pages, download_info):
+        """下载线程：用独立的事件循环下载合集，结果（保存的文件列表或异常）通过 collection_finished 信号交回界面线程"""
+        async def download():
+            try:
+                return await self.downloader.download_collection(bvid, save_path, quality, pages)
+            finally:
+                # 连接池按事件循环区分，只关闭本线程的，界面线程的连接池保留
+                await self.downloader.engine.close()
+                await self.downloader.video.async_client.close()
+
+        loop = asyncio.new_event_loop()
+        try:
+            result = loop.run_until_complete(download())
+        except Exception as e:
+            result = e
+        finally:
+            loop.close()
+        self.collection_finished.emit(result, download_info)
+
+    def on_collection_finished(self, saved, download_info):
+        """合集下载结束，记录历史并提示"""
+        self.collection_running = False
+        bvid = download_info['bvid']
+        if isinstance(saved, Exception):
+            self.show_download_error(saved, bvid)
+            return
+
+        page_count = download_info.pop('page_count')
+        title = self.downloader.get_title(bvid)
+        download_info['title'] = f"{title} ({len(saved)}/{page_count}P)"
+        download_info['timestamp'] = QtCore.QDateTime.currentDateTime().toString('yyyy-MM-dd hh:mm:ss')
+        self.save_history(download_info)
+        self.config['last_save_path'] = download_info['save_path']
+        self.save_config()
+
+        self.download_progress.emit(100, f"下载完成：{len(saved)}/{page_count}P")
+        message = f"已完成 {len(saved)}/{page_count}P\n保存位置：{os.path.join(download_info['save_path'], title)}"
+        if self.downloader.error_download:
+            message += "\n\n失败的分P：\n" + "\n".join(self.downloader.error_download)
+            QtWidgets.QMessageBox.warning(self, "部分失败", message)
+        else:
+            QtWidgets.QMessageBox.information(self, "成功", message)
+
     def check_video(self):
         """检查视频信息"""
         try:
@@ -912,9 +1016,12 @@ class BiliDownloaderGUI(QtWidgets.QMainWindow):
             for q in quality_list:
                 self.quality_combo.addItem(f"{quality_map.get(q, f'{q}')} - {q}", q)
 
+            page_count = len(self.downloader.video.get_info(bvid)['data']['pages'])
+
             self.progress.setValue(100)
             self.status_label.setText("视频信息获取成功")
-            QtWidgets.QMessageBox.information(self, "成功", f"视频信息获取成功！\n标题：{title}")
+            QtWidgets.QMessageBox.information(
+                self, "成功", f"视频信息获取成功！\n标题：{title}\n分P数量：{page_count}")
 
         except Exception as e:
             self.status_label.setText("视频检查失败")
@@ -923,6 +1030,7 @@ class BiliDownloaderGUI(QtWidgets.QMainWindow):
 
     def start_download(self):
         """开始下载处理"""
+        bvid = None
         try:
             # 获取并验证必要的输入参数
             sessdata = self.sessdata_input.text().strip()
@@ -951,10 +1059,20 @@ class BiliDownloaderGUI(QtWidgets.QMainWindow):
                 QtWidgets.QMessageBox.warning(self, "警告", "请先检查视频并选择质量")
                 return
 
-            # 创建下载器实例并传入进度回调
-            self.downloader = BiliVideoDownloader(
-                progress_callback=lambda progress, status: self.download_progress.emit(progress, status)
-            )
+            if self.collection_running:
+                QtWidgets.QMessageBox.warning(self, "警告", "正在下载合集，请等待完成后再开始新的下载")
+                return
+
+            # 复用下载器实例（保留连接池），只更新进度回调
+            self.downloader.progress_callback = \
+                lambda progress, status: self.download_progress.emit(progress, status)
+
+            # 编码选择策略
+            self.config['codec_policy'] = self.codec_combo.currentIndex()
+            self.config['stream_mux'] = self.stream_mux_checkbox.isChecked()
+            self.save_config()
+            self.downloader.stream_selector = self.codec_policies[self.codec_combo.currentText()]
+            self.downloader.streaming_mux = self.stream_mux_checkbox.isChecked()
 
             # 更新状态显示
             self.status_label.setText("正在下载...")
@@ -963,91 +1081,135 @@ class BiliDownloaderGUI(QtWidgets.QMainWindow):
             # 设置下载器的cookie
             self.downloader.set_cookie(sessdata)
 
+            # 指定了分P范围时按合集模式下载
+            pages_text = self.pages_input.text().strip()
+            if pages_text:
+                self.download_collection(bvid, save_path, quality, pages_text)
+                return
+
             # 获取视频和音频流
-            videore, audiore = self.downloader.video.get_video(bvid, pages=1, quality=quality)
+            videore, audiore = self.downloader.video.get_video(
+                bvid, pages=1, quality=quality, selector=self.downloader.stream_selector)
 
             # 创建临时文件路径
             temp_dir = os.path.join(save_path, '.temp')
             os.makedirs(temp_dir, exist_ok=True)
-            filename_temp = os.path.join(temp_dir, str(int(time.time())))
+            # 临时文件名由视频和所选的音视频流决定，下载中断后再次下载可从断点继续
+            video_stream, audio_stream = self.downloader.video.selected_streams
+            filename_temp = self.downloader.temp_filename(temp_dir, f"{bvid}_p1", video_stream, audio_stream)
+            if filename_temp in self.merging:
+                self.status_label.setText("等待合并完成")
+                QtWidgets.QMessageBox.warning(self, "警告", "该视频正在合并，请等待合并完成后再下载")
+                return
 
             # 获取视频标题
             title = self.downloader.get_title(bvid)
             final_path = os.path.join(save_path, title)
 
             # 开始下载
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                success = loop.run_until_complete(
-                    self.downloader.download_both(filename_temp, videore, audiore)
-                )
-            finally:
-                loop.close()
+            download_info = {
+                'title': title,
+                'quality': f"{self.quality_combo.currentText()}",
+                'save_path': save_path,
+                'bvid': bvid,
+                'final_path': final_path,
+                'temp_dir': temp_dir
+            }
+            asyncio.set_event_loop(self.loop)
+            if self.downloader.can_stream_mux():
+                # 边下载边合并，不写临时文件
+                if not self.loop.run_until_complete(
+                        self.downloader.download_streaming(final_path, videore, audiore)):
+                    raise Exception("下载失败")
+                self.finish_download(download_info)
+                return
+
+            success = self.loop.run_until_complete(
+                self.downloader.download_both(filename_temp, videore, audiore)
+            )
 
             if not success:
                 raise Exception("下载失败")
 
-            # 在合并之前直接发送进度信信号
+            # 合并在后台进行，界面保持响应，完成后由 merge_finished 信号通知
             self.download_progress.emit(90, "正在合并视频，请稍后...")
-            QtWidgets.QApplication.processEvents()  # 确保UI更新
-
-            # 合并视频
-            if not self.downloader.merge_videos(filename_temp, final_path):
-                raise Exception("合并失败")
 
-            # 合并完成后发送完成信号
-            self.download_progress.emit(100, "下载完成！")
+            def merge_progress(event):
+                # 合并线程中调用，通过信号更新界面；合并占进度条的最后10%
+                self.download_progress.emit(90 + int((event.percentage or 0) / 10),
+                                            self.downloader.format_merge_progress("视频", event))
 
-            # 清理临时文件夹
+            download_info['filename_temp'] = filename_temp
+            self.merging.add(filename_temp)
             try:
-                if os.path.exists(temp_dir):
-                    import shutil
-                    shutil.rmtree(temp_dir)
-            except Exception as e:
-                print(f"清理临时文件夹失败: {str(e)}")
+                future = self.downloader.mux_stage.submit(filename_temp, final_path, merge_progress)
+            except Exception:
+                self.merging.discard(filename_temp)
+                raise
+            future.add_done_callback(lambda f: self.merge_finished.emit(f, download_info))
 
-            # 保存下载历史记录
-            download_info = {
-                'title': title,
-                'quality': f"{self.quality_combo.currentText()}",
-                'save_path': save_path,
-                'bvid': bvid,
-                'timestamp': QtCore.QDateTime.currentDateTime().toString('yyyy-MM-dd hh:mm:ss')
-            }
-            self.save_history(download_info)
+        except Exception as e:
+            self.show_download_error(e, bvid)
 
-            # 保存新的配置
-            self.config['last_save_path'] = save_path
-            self.save_config()
+    def on_merge_finished(self, future, download_info):
+        """后台合并结束"""
+        self.merging.discard(download_info.pop('filename_temp'))
+        try:
+            if not future.result():
+                raise Exception("合并失败")
+            self.finish_download(download_info)
+        except Exception as e:
+            self.show_download_error(e, download_info['bvid'])
 
-            # 显示成功消息
-            success_message = f"视频下载完成！\n保存位置：{final_path}.mp4"
-            QtWidgets.QMessageBox.information(self, "成功", success_message)
+    def finish_download(self, download_info):
+        """下载（及合并）完成后清理临时文件夹、记录历史并提示"""
+        self.download_progress.emit(100, "下载完成！")
 
+        # 清理临时文件夹；其他仍在合并的任务的临时文件还在时保留
+        temp_dir = download_info.pop('temp_dir')
+        try:
+            if os.path.exists(temp_dir) and not os.listdir(temp_dir):
+                os.rmdir(temp_dir)
         except Exception as e:
-            # 更新失败状态
-            self.status_label.setText("下载失败")
-            self.progress.setValue(0)
+            print(f"清理临时文件夹失败: {str(e)}")
 
-            # 显示详细的错误信息
-            error_message = (
-                f"下载过程中出错：\n{str(e)}\n\n"
-                "可能的原因：\n"
-                "1. 网络连接不稳定\n"
-                "2. 存储空间不足\n"
-                "3. 视频文件过大\n"
-                "4. SESSDATA无效或过期\n"
-                "\n建议：\n"
-                "- 检查网络连接\n"
-                "- 确保有足够的存储空间\n"
-                "- 尝试下载较低质量的视频\n"
-                "- 更新SESSDATA"
-            )
-            QtWidgets.QMessageBox.critical(self, "错误", error_message)
+        # 保存下载历史记录
+        final_path = download_info.pop('final_path')
+        download_info['timestamp'] = QtCore.QDateTime.currentDateTime().toString('yyyy-MM-dd hh:mm:ss')
+        self.save_history(download_info)
+
+        # 保存新的配置
+        self.config['last_save_path'] = download_info['save_path']
+        self.save_config()
+
+        # 显示成功消息
+        success_message = f"视频下载完成！\n保存位置：{final_path}.mp4"
+        QtWidgets.QMessageBox.information(self, "成功", success_message)
+
+    def show_download_error(self, e, bvid=None):
+        """显示下载失败信息"""
+        # 更新失败状态
+        self.status_label.setText("下载失败")
+        self.progress.setValue(0)
+
+        # 显示详细的错误信息
+        error_message = (
+            f"下载过程中出错：\n{str(e)}\n\n"
+            "可能的原因：\n"
+            "1. 网络连接不稳定\n"
+            "2. 存储空间不足\n"
+            "3. 视频文件过大\n"
+            "4. SESSDATA无效或过期\n"
+            "\n建议：\n"
+            "- 检查网络连接\n"
+            "- 确保有足够的存储空间\n"
+            "- 尝试下载较低质量的视频\n"
+            "- 更新SESSDATA"
+        )
+        QtWidgets.QMessageBox.critical(self, "错误", error_message)
 
-            # 打印错误日志
-            print(f"下载失败 - BV号: {bvid}, 错误信息: {str(e)}")
+        # 打印错误日志
+        print(f"下载失败 - BV号: {bvid}, 错误信息: {str(e)}")
 
     def init_style(self):
         """设置窗口样式"""
@@ -2,244 +2,395 @@ import time
 import re
 import os
 import asyncio
-import aiohttp
-import aiofiles
-import requests
 import platform
-from concurrent.futures import ThreadPoolExecutor
+import subprocess
+from range_downloader import RangeDownloader, StreamSource, format_size
+from collections import deque
+from stream_mux import StreamingMuxer, MuxStage, FFmpegProcess, MergeProgress, MergeStats
+from fmp4_remuxer import remux, RemuxError
+from ffmpeg_manager import resolve_ffmpeg
+from bili_api import TTLCache, PlayInfo, ApiClient, AsyncApiClient, BulkResolver, SpaceEnumerator, StreamSelector
 
 
 class BiliVideoDownloader:
-    def __init__(self, progress_callback=None):
-        self.video = Video()
+    def __init__(self, progress_callback=None, min_concurrency=2, max_concurrency=32, cache_path=None,
+                 mux_concurrency=2):
+        self.video = Video(cache_path)
         self.error_download = []
         self.progress_callback = progress_callback
+        # 分段下载引擎，连接池、并发控制和主机评分在多个任务之间复用
+        self.engine = RangeDownloader(min_concurrency, max_concurrency)
+        # UP主投稿、收藏夹、合集的分页列举，产出的BV号可直接交给 download_videos
+        self.space = SpaceEnumerator(self.video.async_client)
+        # 音视频流选择策略（编码偏好、音频码率、体积预算）
+        self.stream_selector = StreamSelector()
+        # 边下载边合并：数据经管道直接送入 ffmpeg，不写临时文件（仅支持命名管道的系统）
+        self.streaming_mux = False
+        self.muxer = StreamingMuxer()
+        # 合并时优先用内置的 fMP4 重封装（不启动 ffmpeg），不适用时再回退到 ffmpeg
+        self.native_remux = True
+        # 后台合并阶段，最多同时进行 mux_concurrency 个合并，不阻塞下载
+        self.mux_stage = MuxStage(self.merge_videos, mux_concurrency)
+        # 最近的合并记录（MergeStats），包含用时和吞吐
+        self.merge_stats = deque(maxlen=100)
 
     def set_cookie(self, sess_data):
         """设置cookie"""
         self.video.cookies = {"SESSDATA": sess_data}
 
+    def set_bandwidth_limit(self, bytes_per_second):
+        """设置全局下载限速（字节/秒），0 表示不限速，下载过程中调整立即生效"""
+        self.engine.bandwidth.set_rate(bytes_per_second)
+
+    async def close(self):
+        """关闭下载和接口请求的连接池"""
+        await self.engine.close()
+        await self.video.async_client.close()
+        self.video.client.close()
+        # 写入尚未保存的视频信息缓存
+        await asyncio.get_running_loop().run_in_executor(None, self.video.info_cache.flush)
+        await asyncio.get_running_loop().run_in_executor(None, self.mux_stage.shutdown)
+
+    def close_sync(self):
+        """关闭 save 等同步接口使用的连接池和事件循环"""
+        self.engine.close_sync()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
     async def download_file(self, url, filename, headers, cookies, description, progress_callback):
         """
         下载单个文件
         Args:
-            url: 下载链接
+            url: 下载链接、镜像地址列表（主地址在前）或 StreamSource
             filename: 保存的文件名
             headers: 请求头
             cookies: cookie信息
-            description: 下载描述（用于显示进度）
-            progress_callback: 进度回调函数
+            description: 下载描述（未指定回调时在终端显示进度）
+            progress_callback: 进度回调函数，参数为 ProgressEvent
         Returns:
             bool: 下载是否成功
         """
-        total_size = 0
-        downloaded = [0]
-        part_files = []
-        max_retries = 5
-        base_chunk_size = 1024 * 1024  # 1MB
-        max_concurrent_downloads = 8
-        download_timeout = 30
-        semaphore = asyncio.Semaphore(max_concurrent_downloads)
-
-        async def get_content_length():
-            """获取文件总大小"""
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.head(url, headers=headers, cookies=cookies) as response:
-                        return int(response.headers.get('content-length', 0))
-            except Exception as e:
-                print(f"获取文件大小失败: {str(e)}")
-                return 0
-
-        async def download_chunk(start, end, chunk_index):
-            """
-            下载文件块
-            Args:
-                start: 开始位置
-                end: 结束位置
-                chunk_index: 块索引
-            """
-            part_file = f"{filename}.part{chunk_index}"
-            part_files.append(part_file)
-
-            async with semaphore:
-                for retry in range(max_retries):
-                    try:
-                        chunk_headers = headers.copy()
-                        chunk_headers['Range'] = f'bytes={start}-{end}'
-
-                        timeout = aiohttp.ClientTimeout(total=download_timeout * (retry + 1))
-                        async with aiohttp.ClientSession(timeout=timeout) as session:
-                            async with session.get(url, headers=chunk_headers, cookies=cookies) as response:
-                                if response.status != 206:
-                                    raise Exception(f"服务器不支持断点续传: {response.status}")
-
-                                async with aiofiles.open(part_file, 'wb') as f:
-                                    async for data in response.content.iter_chunked(base_chunk_size):
-                                        if data:
-                                            await f.write(data)
-                                            downloaded[0] += len(data)
-                                            if total_size:
-                                                percentage = min(100, downloaded[0] * 100 / total_size)
-                                                if progress_callback:
-                                                    try:
-                                                        await progress_callback(percentage,
-                                                                                f"{description}: {percentage:.1f}%")
-                                                    except Exception as e:
-                                                        print(f"进度回调出错: {str(e)}")
-                                            await asyncio.sleep(0.001)
-                                return True
-
-                    except Exception as e:
-                        if retry < max_retries - 1:
-                            wait_time = (retry + 1) * 2  # 指数退避
-                            print(f"\n下载块 {chunk_index} 失败: {str(e)}, {wait_time}秒后重试...")
-                            await asyncio.sleep(wait_time)
-                        else:
-                            print(f"\n下载块 {chunk_index} 最终失败: {str(e)}")
-                            raise
-
-        try:
-            # 确保目标目录存在
-            os.makedirs(os.path.dirname(filename), exist_ok=True)
-
-            # 获取文件大小
-            total_size = await get_content_length()
-            if total_size == 0:
-                raise Exception("无法获取文件大小")
-
-            # 根据文件大小动态调整分块
-            chunk_size = max(total_size // 32, 5 * 1024 * 1024)  # 最小5MB
-            chunk_count = (total_size + chunk_size - 1) // chunk_size
-
-            # 创建下载任务
-            tasks = []
-            for i in range(chunk_count):
-                start = i * chunk_size
-                end = min(start + chunk_size - 1, total_size - 1)
-                tasks.append(download_chunk(start, end, i))
-
-            # 执行所有下载任务
-            await asyncio.gather(*tasks)
-
-            # 合并文件块
-            async with aiofiles.open(filename, 'wb') as outfile:
-                for i in range(chunk_count):
-                    part_file = f"{filename}.part{i}"
-                    if os.path.exists(part_file):
-                        async with aiofiles.open(part_file, 'rb') as infile:
-                            while True:
-                                chunk = await infile.read(base_chunk_size)
-                                if not chunk:
-                                    break
-                                await outfile.write(chunk)
-                                await asyncio.sleep(0.001)  # 避免阻塞
+        if progress_callback is None:
+            progress_callback = self.terminal_progress(description)
+        return await self.engine.download(url, filename, headers, cookies, progress_callback)
 
-            return True
+    async def download_both(self, filename_temp, videore, audiore):
+        """
+        同时下载视频和音频文件
+        两个流共用一个区间调度器和连接预算，进度按两者实际字节数合计
+        """
+        def progress_wrapper(event):
+            # 下载占总进度的90%，剩余部分留给合并
+            if self.progress_callback:
+                self.progress_callback(int(event.percentage * 0.9), self.format_progress("音视频下载", event))
+
+        success = await self.engine.download_many(
+            [
+                (videore, f"{filename_temp}.mp4"),
+                (audiore, f"{filename_temp}.mp3")
+            ],
+            self.video.headers,
+            self.video.cookies,
+            progress_wrapper
+        )
+        if not success:
+            print("下载失败: 音视频下载未完成")
+        return success
+
+    async def download_collection(self, bvid, save_path, quality, pages=None, temp_dir=None):
+        """
+        下载多P视频的全部或部分分P，保存到以视频标题命名的文件夹
+        解析第N+1P、下载第NP、合并第N-1P三个阶段流水线并行，所有分P共用同一个连接池；
+        某一P失败只记录到 error_download，不影响其余分P
+        Args:
+            bvid: BV号
+            save_path: 保存目录
+            quality: 视频质量，某一P没有该质量时使用不高于它的最高质量；编码和音轨由 stream_selector 决定
+            pages: 分P序号列表（从1开始），为空时下载全部
+            temp_dir: 临时文件目录，默认为 save_path 下的 .temp
+        Returns:
+            list: 成功保存的文件路径（不含扩展名）
+        """
+        info = await self.video.get_info_async(bvid)
+        if info is False:
+            raise ValueError("无效的BV号")
+        page_count = len(info['data']['pages'])
+        pages = [page for page in (pages or range(1, page_count + 1)) if 1 <= page <= page_count]
+        if not pages:
+            raise ValueError("没有可下载的分P")
+        folder = os.path.join(save_path, self.title_filterate(info['data']['title']))
+        temp_dir = temp_dir or os.path.join(save_path, '.temp')
+        os.makedirs(folder, exist_ok=True)
+
+        async def resolve_pages():
+            for page in pages:
+                label = f"P{page}"
+                try:
+                    cid = await self.video.get_cid_async(bvid, page)
+                    play_info = await self.video.get_play_info_async(bvid, cid)
+                    if play_info is None:
+                        raise ValueError("无法获取视频和音频的URL")
+                    final_path = os.path.join(folder, self.get_title_collection(bvid, page))
+                    yield self._pipeline_item(label, play_info, quality, temp_dir, f"{bvid}_p{page}", final_path)
+                except Exception as e:
+                    yield label, None, None, None, None, str(e)
 
-        except Exception as e:
-            print(f"\n下载失败: {str(e)}")
-            return False
+        return await self._run_pipeline(resolve_pages(), len(pages))
 
-        finally:
-            # 清理分块文件
-            for part_file in part_files:
+    async def download_videos(self, sources, save_path, quality, concurrency=4, temp_dir=None):
+        """
+        批量下载多个视频（各自的P1），sources 可以是BV号/链接的列表，
+        也可以是 bili_api.SpaceEnumerator 产生的异步生成器：列表的第一页到达后即开始下载
+        元数据按 concurrency 并发解析，下载和合并与 download_collection 相同，流水线并行
+        Returns:
+            list: 成功保存的文件路径（不含扩展名）
+        """
+        temp_dir = temp_dir or os.path.join(save_path, '.temp')
+        os.makedirs(save_path, exist_ok=True)
+
+        async def resolve_videos():
+            async for result in self.resolve_many(sources, concurrency):
+                label = result.bvid or result.source
+                if result.error:
+                    yield label, None, None, None, None, result.error
+                    continue
                 try:
-                    if os.path.exists(part_file):
-                        os.remove(part_file)
+                    final_path = os.path.join(save_path, self.title_filterate(result.title))
+                    yield self._pipeline_item(label, result.play_info, quality, temp_dir,
+                                              f"{result.bvid}_p1", final_path)
                 except Exception as e:
-                    print(f"清理分块文件失败: {str(e)}")
+                    yield label, None, None, None, None, str(e)
 
-    async def download_both(self, filename_temp, videore, audiore):
+        return await self._run_pipeline(resolve_videos())
+
+    def _pipeline_item(self, label, play_info, quality, temp_dir, temp_name, final_path):
+        """选择音视频流，生成流水线的一项：(标签, 视频流, 音频流, 临时文件名, 保存路径, 错误)"""
+        video, audio = self.stream_selector.select(play_info, quality)
+        if video is None or audio is None:
+            raise ValueError("没有可用的音视频流")
+        filename_temp = self.temp_filename(temp_dir, temp_name, video, audio)
+        return label, video, audio, filename_temp, final_path, None
+
+    @staticmethod
+    def temp_filename(temp_dir, temp_name, video, audio):
         """
-        下载视频和音频文件
+        临时文件名（不含扩展名）：包含清晰度、编码和音轨，
+        同一组音视频流再次下载时可以断点续传，换了编码或音轨则不会误用旧的数据和日志
         """
-        try:
-            async def progress_wrapper(progress, status, file_type):
-                if file_type == "audio":
-                    # 音频下载占20%
-                    total_progress = progress * 0.2
-                else:  # video
-                    # 视频下载占70% (20-90%)
-                    total_progress = 20 + (progress * 0.7)
-
-                if self.progress_callback:
-                    self.progress_callback(int(total_progress), status)
-
-            # 先下载音频
-            audio_success = await self.download_file(
-                audiore.url,
-                f"{filename_temp}.mp3",
-                self.video.headers,
-                self.video.cookies,
-                "音频下载",
-                lambda p, s: progress_wrapper(p, s, "audio")
-            )
-
-            if not audio_success:
-                raise Exception("音频下载失败")
-
-            # 下载视频
-            video_success = await self.download_file(
-                videore.url,
-                f"{filename_temp}.mp4",
-                self.video.headers,
-                self.video.cookies,
-                "视频下载",
-                lambda p, s: progress_wrapper(p, s, "video")
-            )
-
-            if not video_success:
-                raise Exception("视频下载失败")
+        return os.path.join(temp_dir, f"{temp_name}_{video.id}_{video.codecid}_{audio.id}")
 
-            return True
+    async def _run_pipeline(self, items, total=None):
+        """
+        下载、合并两个阶段流水线并行，items 的解析在前面再提前一项
+        Args:
+            items: 异步可迭代对象，元素由 _pipeline_item 生成，解析失败的项带有错误信息
+            total: 总数，已知时按每项完成比例汇总进度，未知时显示当前项的进度
+        Returns:
+            list: 成功保存的文件路径（不含扩展名）
+        """
+        self.error_download = []
+        saved = []
+        # 每一项的完成比例，下载占90%，合并占10%
+        fractions = {}
+        # 阶段之间的队列只缓冲一项：最多提前解析一项，最多一项等待合并
+        resolved = asyncio.Queue(maxsize=1)
+        downloaded = asyncio.Queue(maxsize=1)
+        # 流水线结束后，仍在运行的合并线程转回的进度不再汇报
+        finished = False
+
+        def report(index, fraction, status):
+            if finished:
+                return
+            fractions[index] = max(fractions.get(index, 0.0), fraction)
+            if self.progress_callback:
+                if total:
+                    overall = sum(fractions.values()) / total * 100
+                    self.progress_callback(int(overall), f"[{index + 1}/{total}] {status}")
+                else:
+                    self.progress_callback(int(fraction * 100), f"[{index + 1}] {status}")
+
+        def fail(index, label, error):
+            fractions[index] = 1.0
+            self.error_download.append(f"{label}: {error}")
+            print(f"{label} 下载失败: {error}")
+
+        async def resolve_stage():
+            index = 0
+            async for item in items:
+                await resolved.put((index,) + item)
+                index += 1
+            await resolved.put(None)
+
+        async def download_stage():
+            while True:
+                item = await resolved.get()
+                if item is None:
+                    break
+                index, label, video, audio, filename_temp, final_path, error = item
+                if error:
+                    fail(index, label, error)
+                    continue
+                progress = (lambda event, index=index, label=label: report(
+                    index, event.percentage / 100 * 0.9, self.format_progress(f"{label} 音视频下载", event)))
+                if self.can_stream_mux():
+                    # 下载的同时完成合并，不经过合并阶段
+                    if await self.download_streaming(final_path, StreamSource(video.urls, video.size),
+                                                     StreamSource(audio.urls, audio.size), progress):
+                        saved.append(final_path)
+                        report(index, 1.0, f"{label} 完成")
+                    else:
+                        fail(index, label, "边下载边合并未完成")
+                    continue
+                success = await self.engine.download_many(
+                    [
+                        (StreamSource(video.urls, video.size), f"{filename_temp}.mp4"),
+                        (StreamSource(audio.urls, audio.size), f"{filename_temp}.mp3")
+                    ],
+                    self.video.headers,
+                    self.video.cookies,
+                    progress
+                )
+                if success:
+                    await downloaded.put((index, label, filename_temp, final_path))
+                else:
+                    fail(index, label, "音视频下载未完成")
+            await downloaded.put(None)
+
+        async def mux_one(index, label, filename_temp, final_path):
+            report(index, 0.9, f"{label} 正在合并")
+            loop = asyncio.get_running_loop()
+
+            def progress(event):
+                # 合并线程中调用，转回事件循环更新进度
+                fraction = 0.9 + (event.percentage or 0) / 1000
+                loop.call_soon_threadsafe(report, index, fraction, self.format_merge_progress(label, event))
+
+            if await self.mux_stage.run(filename_temp, final_path, progress):
+                saved.append(final_path)
+                report(index, 1.0, f"{label} 完成")
+            else:
+                fail(index, label, "合并失败")
 
-        except Exception as e:
-            print(f"下载失败: {str(e)}")
-            return False
+        async def mux_stage():
+            # 合并交给后台阶段，同时进行的合并达到上限时才停止接收，下载阶段随之等待
+            merging = set()
+            try:
+                while True:
+                    item = await downloaded.get()
+                    if item is None:
+                        break
+                    merging.add(asyncio.ensure_future(mux_one(*item)))
+                    if len(merging) >= self.mux_stage.concurrency:
+                        _, merging = await asyncio.wait(merging, return_when=asyncio.FIRST_COMPLETED)
+                await asyncio.gather(*merging)
+            finally:
+                # 其他阶段出错时取消等待中的合并，不在流水线返回后再记录结果
+                for task in merging:
+                    task.cancel()
+                await asyncio.gather(*merging, return_exceptions=True)
 
-    def merge_videos(self, filename_temp, filename_new):
+        stages = [asyncio.ensure_future(stage()) for stage in (resolve_stage, download_stage, mux_stage)]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            finished = True
+        return saved
+
+    def parse_pages(self, text, page_count):
+        """
+        解析分P范围，如 "1-3,5"；"all" 或 "全部" 表示全部分P
+        Returns:
+            list: 分P序号列表，超出范围的序号被忽略
+        """
+        text = text.strip().lower()
+        if text in ('all', '全部'):
+            return list(range(1, page_count + 1))
+        pages = []
+        for part in re.split(r'[,，\s]+', text):
+            if not part:
+                continue
+            start, _, end = part.partition('-')
+            for page in range(int(start), int(end or start) + 1):
+                if 1 <= page <= page_count and page not in pages:
+                    pages.append(page)
+        return pages
+
+    def can_stream_mux(self):
+        return self.streaming_mux and self.muxer.supported()
+
+    async def download_streaming(self, filename_new, videore, audiore, progress_callback=None):
+        """
+        边下载边合并为 {filename_new}.mp4，不写入临时文件
+        progress_callback 参数为 ProgressEvent，为空时使用下载器的进度回调
+        """
+        def progress_wrapper(event):
+            if self.progress_callback:
+                self.progress_callback(int(event.percentage), self.format_progress("下载并合并", event))
+
+        success = await self.muxer.mux(self.engine, videore, audiore, f"{filename_new}.mp4",
+                                       self.video.headers, self.video.cookies,
+                                       progress_callback or progress_wrapper)
+        if not success:
+            print("下载失败: 边下载边合并未完成")
+        return success
+
+    def merge_videos(self, filename_temp, filename_new, progress_callback=None):
         """
         合并视频和音频文件
+        progress_callback 参数为 stream_mux.MergeProgress，在执行合并的线程中调用
         """
         try:
-            import subprocess
             video_path = f"{filename_temp}.mp4"
             audio_path = f"{filename_temp}.mp3"
 
             if not os.path.exists(video_path) or not os.path.exists(audio_path):
                 raise ValueError("视频或音频文件丢失")
 
-            cmd = [
-                'ffmpeg',
-                '-i', video_path,
-                '-i', audio_path,
-                '-c:v', 'copy',
-                '-c:a', 'copy',
-                '-y',
-                f"{filename_new}.mp4"
-            ]
-
-            # 准备subprocess参数
-            kwargs = {
-                'stdout': subprocess.PIPE,
-                'stderr': subprocess.PIPE
-            }
-            if platform.system() == 'Windows':
-                kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
-
-            process = subprocess.Popen(cmd, **kwargs)
-            stdout, stderr = process.communicate()
-
-            if process.returncode != 0:
-                raise Exception(f"FFmpeg失败: {stderr.decode()}")
+            output = f"{filename_new}.mp4"
+            # 直接复制流，输出大小与输入之和相近，用于估算进度
+            total_size = os.path.getsize(video_path) + os.path.getsize(audio_path)
+            start = time.time()
+
+            method = 'native'
+            if not (self.native_remux and
+                    self.remux_native(video_path, audio_path, output, total_size, progress_callback)):
+                method = 'ffmpeg'
+                ffmpeg = resolve_ffmpeg()
+                if ffmpeg is None:
+                    raise Exception("未找到FFmpeg")
+                if ffmpeg.muxers and 'mp4' not in ffmpeg.muxers:
+                    raise Exception(f"FFmpeg不支持mp4封装: {ffmpeg.path}")
+                cmd = [
+                    ffmpeg.path,
+                    '-loglevel', 'error',
+                    '-i', video_path,
+                    '-i', audio_path,
+                    '-c:v', 'copy',
+                    '-c:a', 'copy',
+                    '-y',
+                    output
+                ]
+
+                # 准备subprocess参数
+                kwargs = {}
+                if platform.system() == 'Windows':
+                    kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
+
+                process = FFmpegProcess(cmd, total_size, progress_callback, **kwargs)
+                if process.wait() != 0:
+                    raise Exception(f"FFmpeg失败: {process.error_output}")
+
+            self.record_merge(output, method, total_size, time.time() - start)
 
             # 清理临时文件
-            try:
-                os.remove(video_path)
-                os.remove(audio_path)
-            except Exception as e:
-                print(f"清理临时文件失败: {str(e)}")
+            self.remove_temp_files(video_path, audio_path)
 
             return True
 
@@ -247,150 +398,66 @@ class BiliVideoDownloader:
             print(f"合并失败: {str(e)}")
             return False
 
-        except Exception as e:
-            print(f"合并失败: {str(e)}")
-            return False
+    def record_merge(self, output, method, size, seconds):
+        """记录一次合并的用时和吞吐"""
+        throughput = size / seconds if seconds > 0 else 0
+        self.merge_stats.append(MergeStats(output, method, seconds, size, throughput))
+        print(f"合并完成({method}): {os.path.basename(output)}  {self.size(size)}  "
+              f"用时 {seconds:.2f}s  {self.size(throughput)}/s")
 
-    def save(self, directory, videore, audiore):
-        """优化后的异步保存视频和音频文件"""
-        filename_temp = os.path.join(directory, str(time.time()))
-        max_retries = 5  # 增加重试次数
-        base_chunk_size = 1024 * 1024  # 1MB 基础块大小
-        max_concurrent_downloads = 8  # 限制并发数
-        download_timeout = 30  # 增加超时时间
-
-        async def download_file(url, filename, headers, cookies, description):
-            total_size = 0
-            downloaded = [0]
-            part_files = []
-            semaphore = asyncio.Semaphore(max_concurrent_downloads)  # 控制并发数
-
-            async def get_content_length():
-                async with aiohttp.ClientSession() as session:
-                    async with session.head(url, headers=headers, cookies=cookies) as response:
-                        return int(response.headers.get('content-length', 0))
-
-            async def download_chunk(start, end, chunk_index):
-                part_file = f"{filename}.part{chunk_index}"
-                part_files.append(part_file)
-
-                async with semaphore:  # 使用信号量控制并发
-                    for retry in range(max_retries):
-                        try:
-                            chunk_headers = headers.copy()
-                            chunk_headers['Range'] = f'bytes={start}-{end}'
-
-                            timeout = aiohttp.ClientTimeout(total=download_timeout * (retry + 1))
-                            async with aiohttp.ClientSession(timeout=timeout) as session:
-                                async with session.get(url, headers=chunk_headers, cookies=cookies) as response:
-                                    if response.status != 206:
-                                        raise Exception(f"服务器不支持断点续传: {response.status}")
-
-                                    # 使用临时文件写入数据
-                                    async with aiofiles.open(part_file, 'wb') as f:
-                                        async for data in response.content.iter_chunked(base_chunk_size):
-                                            if data:
-                                                await f.write(data)
-                                                downloaded[0] += len(data)
-                                                # 更新进度
-                                                if total_size:
-                                                    percentage = min(100, downloaded[0] * 100 / total_size)
-                                                    print(f"\r{description}: {percentage:.1f}%", end="", flush=True)
-                                                # 定期释放控制权
-                                                await asyncio.sleep(0.001)
-                                    return True
-
-                        except Exception as e:
-                            if retry < max_retries - 1:
-                                wait_time = (retry + 1) * 2  # 指数退避
-                                print(f"\n下载块 {chunk_index} 失败: {str(e)}, {wait_time}秒后重试...")
-                                await asyncio.sleep(wait_time)
-                            else:
-                                print(f"\n下载块 {chunk_index} 最终失败: {str(e)}")
-                                raise
+    @staticmethod
+    def remux_native(video_path, audio_path, output, total_size=None, progress_callback=None):
+        """
+        内置的 fMP4 重封装：只改写 box 头部，媒体数据在内核中直接复制
+        Returns:
+            bool: 是否成功，失败时由 ffmpeg 接手
+        """
+        def progress(out_time, size):
+            percentage = min(size / total_size * 100, 100.0) if total_size else None
+            progress_callback(MergeProgress(out_time, None, size, total_size, percentage))
 
-            try:
-                # 获取文件大小
-                total_size = await get_content_length()
-                if total_size == 0:
-                    raise Exception("无法获取文件大小")
-
-                # 根据文件大小动态调整分块
-                chunk_size = max(total_size // 32, 5 * 1024 * 1024)  # 最小5MB
-                chunk_count = (total_size + chunk_size - 1) // chunk_size
-
-                # 创建下载任务
-                tasks = []
-                for i in range(chunk_count):
-                    start = i * chunk_size
-                    end = min(start + chunk_size - 1, total_size - 1)
-                    tasks.append(download_chunk(start, end, i))
-
-                # 执行所有下载任务
-                await asyncio.gather(*tasks)
-
-                # 合并文件块
-                async with aiofiles.open(filename, 'wb') as outfile:
-                    for i in range(chunk_count):
-                        part_file = f"{filename}.part{i}"
-                        if os.path.exists(part_file):
-                            async with aiofiles.open(part_file, 'rb') as infile:
-                                while True:
-                                    chunk = await infile.read(base_chunk_size)
-                                    if not chunk:
-                                        break
-                                    await outfile.write(chunk)
-                                await asyncio.sleep(0.001)  # 避免阻塞
-
-                return True
+        try:
+            remux(video_path, audio_path, output, progress if progress_callback else None)
+            return True
+        except RemuxError as e:
+            print(f"内置合并不适用，改用 FFmpeg: {str(e)}")
+        except Exception as e:
+            print(f"内置合并失败，改用 FFmpeg: {str(e)}")
+        return False
 
-            except Exception as e:
-                print(f"\n下载失败: {str(e)}")
-                return False
+    @staticmethod
+    def remove_temp_files(*paths):
+        """清理临时文件"""
+        try:
+            for path in paths:
+                os.remove(path)
+        except Exception as e:
+            print(f"清理临时文件失败: {str(e)}")
 
-            finally:
-                # 清理分块文件
-                for part_file in part_files:
-                    try:
-                        if os.path.exists(part_file):
-                            os.remove(part_file)
-                    except Exception as e:
-                        print(f"清理分块文件失败: {str(e)}")
-
-        async def download_both():
-            tasks = []
-            # 视频下载任务
-            tasks.append(download_file(
-                videore.url,
-                f"{filename_temp}.mp4",
-                self.video.headers,
-                self.video.cookies,
-                "视频下载"
-            ))
-            # 音频下载任务
-            tasks.append(download_file(
-                audiore.url,
-                f"{filename_temp}.mp3",
-                self.video.headers,
-                self.video.cookies,
-                "音频下载"
-            ))
-
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            return all(isinstance(r, bool) and r for r in results)
-
-        # 使用线程池执行异步任务
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            future = executor.submit(lambda: asyncio.run(download_both()))
-            try:
-                success = future.result()
-                if not success:
-                    self.cleanup_file_parts(filename_temp)
-                    raise Exception("下载过程中发生错误")
-                return filename_temp
-            except Exception as e:
+    def save(self, directory, videore, audiore, filename_temp=None):
+        """
+        同步保存视频和音频文件
+        指定固定的 filename_temp 时，失败后保留已下载的数据，再次调用可断点续传
+        """
+        resumable = filename_temp is not None
+        if not resumable:
+            filename_temp = os.path.join(directory, str(time.time()))
+
+        success = self.engine.download_sync(
+            [
+                (videore, f"{filename_temp}.mp4"),
+                (audiore, f"{filename_temp}.mp3")
+            ],
+            self.video.headers,
+            self.video.cookies,
+            self.terminal_progress("音视频下载")
+        )
+        if not success:
+            # 可续传时保留已下载数据及日志
+            if not resumable:
                 self.cleanup_file_parts(filename_temp)
-                raise Exception(f"下载失败: {str(e)}")
+            raise Exception("下载失败: 下载过程中发生错误")
+        return filename_temp
 
     # 原始代码的辅助方法
     def remove(self, filename_temp):
@@ -401,39 +468,53 @@ class BiliVideoDownloader:
             pass
 
     def cleanup_file_parts(self, filename_temp):
-        """清理所有相关的临时文件，包括分块文件"""
-        # 删除主文件
-        for ext in [".mp4", ".mp3"]:
+        """清理所有相关的临时文件，包括续传日志"""
+        for ext in [".mp4", ".mp3", ".mp4.journal", ".mp3.journal"]:
             try:
                 if os.path.exists(filename_temp + ext):
                     os.remove(filename_temp + ext)
             except Exception as e:
                 print(f"删除{ext}文件时出错: {str(e)}")
 
-        # 删除所有分块文件
-        base_dir = os.path.dirname(filename_temp)
-        base_name = os.path.basename(filename_temp)
-        try:
-            for file in os.listdir(base_dir):
-                if file.startswith(base_name) and ".part" in file:
-                    try:
-                        os.remove(os.path.join(base_dir, file))
-                    except Exception as e:
-                        print(f"删除分块文件{file}时出错: {str(e)}")
-        except Exception as e:
-            print(f"清理分块文件时出错: {str(e)}")
+    def terminal_progress(self, description):
+        """返回在终端单行刷新进度的回调"""
+        def on_progress(event):
+            print(f"\r{self.format_progress(description, event)}", end="", flush=True)
+        return on_progress
+
+    def format_progress(self, description, event):
+        """把进度事件格式化为状态文本，包含速度和预计剩余时间"""
+        status = f"{description}: {event.percentage:.1f}%  {self.size(event.smoothed_speed)}/s"
+        if event.eta is not None and event.downloaded < event.total:
+            minutes, seconds = divmod(int(event.eta), 60)
+            status += f"  剩余 {minutes:02d}:{seconds:02d}"
+        return status
+
+    def format_merge_progress(self, description, event):
+        """把合并进度格式化为状态文本"""
+        status = f"{description} 正在合并"
+        if event.percentage is not None:
+            status += f": {event.percentage:.1f}%"
+        if event.out_time is not None:
+            minutes, seconds = divmod(int(event.out_time), 60)
+            status += f"  已处理 {minutes:02d}:{seconds:02d}"
+        if event.speed:
+            status += f"  {event.speed:.1f}x"
+        return status
 
     def get_bit(self, videore, audiore):
-        return int(videore.headers.get('Content-Length')) + int(audiore.headers.get('Content-Length'))
+        """音视频总大小，未知的部分按0计算（下载开始后由引擎回填）"""
+        return (videore.size or 0) + (audiore.size or 0)
 
     def size(self, bit):
-        value = int(bit)
-        units = ["B", "KB", "MB", "GB", "TB", "PB"]
-        size = 1024.0
-        for i in range(len(units)):
-            if (value / size) < 1:
-                return "%.2f%s" % (value, units[i])
-            value = value / size
+        return format_size(bit)
+
+    def resolve_many(self, sources, concurrency=8, pages=1):
+        """
+        批量解析BV号或链接，返回异步生成器，按完成顺序产出 ResolveResult
+        例: async for result in downloader.resolve_many(bv_list): ...
+        """
+        return BulkResolver(self.video, concurrency).resolve(sources, pages)
 
     def is_directory_exist(self, directory):
         return os.path.exists(directory)
@@ -458,9 +539,13 @@ class BiliVideoDownloader:
 
 
 class Video:
-    def __init__(self):
+    def __init__(self, cache_path=None):
         self.api_info = 'https://api.bilibili.com/x/web-interface/view?bvid={}'
-        self.api_url = 'https://api.bilibili.com/x/player/wbi/playurl?bvid={}&cid={}&fnval=4048'
+        self.api_url = 'https://api.bilibili.com/x/player/wbi/playurl'
+        # 接口客户端：同步版基于连接池 Session，异步版与其共用请求头、cookie 和重试策略；
+        # WBI 密钥与视频信息缓存放在同一目录
+        self.client = ApiClient(wbi_cache_path=cache_path and f"{os.path.splitext(cache_path)[0]}_wbi.json")
+        self.async_client = AsyncApiClient(self.client)
         self.headers = {
             "referer": "https://www.bilibili.com",
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
@@ -468,81 +553,134 @@ class Video:
         }
         # 初始化 cookies
         self.cookies = {}
+        # 视频信息缓存，按 bvid 保存 view 接口的响应，指定 cache_path 时持久化到磁盘
+        self.info_cache = TTLCache(maxsize=256, ttl=600, path=cache_path)
+        # 播放地址缓存，按 (bvid, cid, cookie) 保存到签名地址过期为止，只保存在内存中
+        self.play_cache = TTLCache(maxsize=64)
+
+    @property
+    def headers(self):
+        return self.client.headers
+
+    @headers.setter
+    def headers(self, value):
+        self.client.headers = value
+
+    @property
+    def cookies(self):
+        return self.client.cookies
+
+    @cookies.setter
+    def cookies(self, value):
+        self.client.cookies = value
 
     def get_info(self, bvid):
-        """ 获取视频信息 """
-        url = self.api_info.format(bvid)
-        response = requests.get(url=url, headers=self.headers)
-        if response.status_code == 200:
-            if response.json()['code'] == 0:
-                return response.json()
-            else:
-                return False
-        else:
+        """ 获取视频信息（优先读取缓存） """
+        data = self.info_cache.get(bvid)
+        if data is not None:
+            return data
+        return self._store_info(bvid, self.client.get_json(self.api_info.format(bvid)))
+
+    async def get_info_async(self, bvid):
+        """ 异步获取视频信息（与 get_info 共用缓存） """
+        data = self.info_cache.get(bvid)
+        if data is not None:
+            return data
+        return self._store_info(bvid, await self.async_client.get_json(self.api_info.format(bvid)))
+
+    def _store_info(self, bvid, data):
+        if data is None or data.get('code') != 0:
             return False
+        self.info_cache.set(bvid, data)
+        return data
 
     def get_cid(self, bvid, pages):
         """ 获取视频cid """
-        url = self.api_info.format(bvid)
-        response = requests.get(url=url, headers=self.headers)
-        if response.status_code == 200:
-            data = response.json()
-            if data['code'] == 0:
-                cid = data['data']['pages'][pages - 1]['cid']
-                return cid
-            else:
-                return False
-        else:
+        data = self.get_info(bvid)
+        if data is False:
             return False
+        return data['data']['pages'][pages - 1]['cid']
+
+    async def get_cid_async(self, bvid, pages):
+        data = await self.get_info_async(bvid)
+        if data is False:
+            return False
+        return data['data']['pages'][pages - 1]['cid']
+
+    def _play_key(self, bvid, cid):
+        return f"{bvid}:{cid}:{'&'.join(f'{k}={v}' for k, v in sorted(self.cookies.items()))}"
+
+    def get_play_info(self, bvid, cid):
+        """ 获取播放信息（PlayInfo），签名地址过期前复用同一份结果 """
+        key = self._play_key(bvid, cid)
+        play_info = self.play_cache.get(key)
+        if play_info is not None:
+            return play_info
+        return self._store_play_info(key, self.client.get_json(self.api_url, self._play_params(bvid, cid), wbi=True))
+
+    async def get_play_info_async(self, bvid, cid):
+        """ 异步获取播放信息（与 get_play_info 共用缓存） """
+        key = self._play_key(bvid, cid)
+        play_info = self.play_cache.get(key)
+        if play_info is not None:
+            return play_info
+        return self._store_play_info(
+            key, await self.async_client.get_json(self.api_url, self._play_params(bvid, cid), wbi=True))
+
+    @staticmethod
+    def _play_params(bvid, cid):
+        return {'bvid': bvid, 'cid': cid, 'fnval': 4048}
+
+    def _store_play_info(self, key, data):
+        if data is None:
+            return None
+        if data.get('code') != 0:
+            print(f"获取播放信息时出错: {data.get('message')}")
+            return None
+        play_info = PlayInfo(data['data'])
+        self.play_cache.set(key, play_info, ttl=play_info.ttl)
+        return play_info
 
     def get_quality(self, bvid, cid):
         """ 获取视频质量列表 """
-        url = self.api_url.format(bvid, cid)
-        response = requests.get(url=url, headers=self.headers, cookies=self.cookies)
-        if response.status_code == 200:
-            data = response.json()
-            if data['code'] == 0:
-                quality_dict = set()  # 使用set而不是list来存储
-                if 'dash' in data['data']:
-                    for i in data['data']['dash']['video']:
-                        quality_dict.add(i['id'])
-                return sorted(list(quality_dict), reverse=True)  # 转换回列表并降序排序
-            else:
-                print(f"获取质量列表时出错: {data['message']}")
-                return []
-        else:
-            print(f"请求质量列表时出错: {response.status_code}")
+        play_info = self.get_play_info(bvid, cid)
+        if play_info is None:
             return []
+        return play_info.quality_list
 
     def request_url(self, bvid, cid):
         """ 获取视频和音频的url """
-        url = self.api_url.format(bvid, cid)
-        response = requests.get(url=url, headers=self.headers, cookies=self.cookies)
-        if response.status_code == 200:
-            data = response.json()
-            if data['code'] == 0:
-                return data['data']
-            else:
-                print(f"获取视频和音频URL时出错: {data['message']}")
-                return None
-        else:
-            print(f"请求视频和音频URL时出错: {response.status_code}")
+        play_info = self.get_play_info(bvid, cid)
+        if play_info is None:
             return None
+        return play_info.data
 
-    def get_video(self, bvid, pages=1, quality=80):
-        """ 视频下载 """
+    def get_video(self, bvid, pages=1, quality=80, selector=None):
+        """
+        视频下载
+        selector 为 StreamSelector 时按其策略选择编码和音轨，默认取该清晰度接口给出的第一种编码和最高码率音轨
+        """
         cid = self.get_cid(bvid, pages)
-        quality_list = self.get_quality(bvid, cid)
-        print(f"可用质量参数: {quality_list}")
-        if quality not in quality_list:
-            raise ValueError(f"无效的质量参数: {quality}")
-        data = self.request_url(bvid, cid)
-        if data is None:
+        play_info = self.get_play_info(bvid, cid)
+        if play_info is None:
             raise ValueError("无法获取视频和音频的URL")
-        video_url = next(i['baseUrl'] for i in data['dash']['video'] if i['id'] == quality)
-        audio_url = data['dash']['audio'][0]['baseUrl']
-        print(f"视频 URL: {video_url}")
-        print(f"音频 URL: {audio_url}")
-        self.videore = requests.get(url=video_url, headers=self.headers, cookies=self.cookies, stream=True)
-        self.audiore = requests.get(url=audio_url, headers=self.headers, cookies=self.cookies, stream=True)
-        return self.videore, self.audiore
\ No newline at end of file
+        print(f"可用质量参数: {play_info.quality_list}")
+        if play_info.video(quality) is None:
+            raise ValueError(f"无效的质量参数: {quality}")
+        video, audio = (selector or StreamSelector()).select(play_info, quality)
+        if audio is None:
+            raise ValueError("没有可用的音频流")
+        print(f"视频 URL: {video.urls[0]}")
+        print(f"音频 URL: {audio.urls[0]}")
+        # 选中的音视频流（StreamInfo），用于生成临时文件名等
+        self.selected_streams = (video, audio)
+        # 只返回下载源描述（含备用CDN地址），不提前建立连接；
+        # 接口没有给出大小时，由下载时第一个分块请求的 Content-Range 得到
+        self.videore = StreamSource(video.urls, video.size)
+        self.audiore = StreamSource(audio.urls, audio.size)
+        return self.videore, self.audiore
+
+    @staticmethod
+    def stream_urls(stream):
+        """ 获取DASH流的主地址和备用地址（backupUrl），主地址在前 """
+        return PlayInfo.stream_urls(stream)
\ No newline at end of file
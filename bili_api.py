@@ -0,0 +1,867 @@
+import os
+import re
+import time
+import json
+import atexit
+import random
+import hashlib
+import asyncio
+import threading
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict, namedtuple
+from urllib.parse import urlsplit, parse_qs, urlencode
+from range_downloader import RetryPolicy
+
+BV_PATTERN = re.compile(r'BV[a-zA-Z0-9]{10}')
+
+
+def extract_bv_number(input_str):
+    """从BV号或视频链接中提取BV号"""
+    # 检查输入是否是BV号
+    if BV_PATTERN.match(input_str):
+        return input_str[:12]
+
+    # 如果输入是链接，从链接中提取BV号
+    match = BV_PATTERN.search(input_str)
+    if match:
+        return match.group(0)
+
+    raise ValueError("输入的字符串中未找到有效的BV号")
+
+
+class TTLCache:
+    """
+    带过期时间的LRU缓存
+    超过 maxsize 时淘汰最久未使用的条目；指定 path 时同时持久化到磁盘(JSON)，
+    程序重启后未过期的条目仍然有效
+    写入不会立即落盘：save_delay 秒内的多次修改合并为一次保存，在后台线程中进行，
+    调用 flush 或进程退出时写入尚未保存的修改
+    """
+
+    # 修改后延迟保存的秒数
+    save_delay = 5.0
+
+    def __init__(self, maxsize=256, ttl=600, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        # key -> (过期时间戳, 值)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # 保证多次保存按顺序写入，旧快照不会覆盖新快照
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._timer = None
+        if path:
+            self._load()
+            atexit.register(self.flush)
+
+    def get(self, key, default=None):
+        """读取缓存，不存在或已过期时返回 default"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """写入缓存，ttl 为空时使用默认过期时间"""
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self._schedule_save()
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._schedule_save()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._schedule_save()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+    def _schedule_save(self):
+        """标记有未保存的修改，并在 save_delay 秒后保存（调用时已持有 _lock）"""
+        if not self.path:
+            return
+        self._dirty = True
+        if self._timer is None:
+            self._timer = threading.Timer(self.save_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """立即保存尚未写入磁盘的修改"""
+        with self._save_lock:
+            with self._lock:
+                timer, self._timer = self._timer, None
+                if not self._dirty:
+                    return
+                self._dirty = False
+                # 只在锁内复制条目列表，序列化和写文件在锁外进行，不阻塞读写缓存
+                snapshot = {key: [expires, value] for key, (expires, value) in self._data.items()}
+            if timer is not None and timer is not threading.current_thread():
+                timer.cancel()
+            self._save(snapshot)
+
+    def _load(self):
+        try:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            now = time.time()
+            for key, (expires, value) in saved.items():
+                if expires > now:
+                    self._data[key] = (expires, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        except Exception as e:
+            print(f"加载缓存文件失败: {e}")
+
+    def _save(self, snapshot):
+        try:
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            print(f"保存缓存文件失败: {e}")
+
+
+# DASH 中的一路视频或音频流
+StreamInfo = namedtuple('StreamInfo', ['id', 'codecs', 'codecid', 'bandwidth', 'width', 'height',
+                                       'frame_rate', 'size', 'urls'])
+
+
+class PlayInfo:
+    """
+    playurl 接口的解析结果
+    包含全部 DASH 视频/音频流（编码、码率、分辨率、主地址和备用地址）以及签名地址的过期时间
+    """
+
+    # 地址中没有 deadline 参数时默认的有效期（秒）
+    default_lifetime = 1800
+    # 提前失效的余量，避免拿到即将过期的地址
+    expiry_margin = 60
+
+    def __init__(self, data):
+        self.data = data
+        dash = data.get('dash') or {}
+        self.duration = dash.get('duration') or data.get('timelength', 0) // 1000
+        self.video_streams = [self.parse_stream(i) for i in dash.get('video') or []]
+        self.audio_streams = [self.parse_stream(i) for i in dash.get('audio') or []]
+        # 杜比全景声和无损音轨排在普通音轨之后
+        self.special_audio_streams = []
+        for extra in ((dash.get('dolby') or {}).get('audio') or [],
+                      [(dash.get('flac') or {}).get('audio')]):
+            self.special_audio_streams.extend(self.parse_stream(i) for i in extra if i)
+        self.audio_streams.extend(self.special_audio_streams)
+        self.expires = self.parse_expires()
+
+    @staticmethod
+    def stream_urls(stream):
+        """ 获取DASH流的主地址和备用地址（backupUrl），主地址在前 """
+        urls = [stream.get('baseUrl') or stream.get('base_url')]
+        for backup in stream.get('backupUrl') or stream.get('backup_url') or []:
+            if backup not in urls:
+                urls.append(backup)
+        return [u for u in urls if u]
+
+    @classmethod
+    def parse_stream(cls, stream):
+        return StreamInfo(
+            id=stream.get('id'),
+            codecs=stream.get('codecs', ''),
+            codecid=stream.get('codecid'),
+            bandwidth=stream.get('bandwidth', 0),
+            width=stream.get('width', 0),
+            height=stream.get('height', 0),
+            frame_rate=stream.get('frameRate') or stream.get('frame_rate'),
+            size=stream.get('size'),
+            urls=cls.stream_urls(stream)
+        )
+
+    def parse_expires(self):
+        """从签名地址的 deadline 参数得到过期时间戳，取所有地址中最早的一个"""
+        deadlines = []
+        for stream in self.video_streams + self.audio_streams:
+            for url in stream.urls:
+                value = parse_qs(urlsplit(url).query).get('deadline')
+                if value and value[0].isdigit():
+                    deadlines.append(int(value[0]))
+        if deadlines:
+            return min(deadlines)
+        return time.time() + self.default_lifetime
+
+    @property
+    def ttl(self):
+        """缓存剩余有效期（秒）"""
+        return max(0, self.expires - self.expiry_margin - time.time())
+
+    @property
+    def quality_list(self):
+        """可用的清晰度 id，降序排列"""
+        return sorted({i.id for i in self.video_streams}, reverse=True)
+
+    def video(self, quality):
+        """指定清晰度的视频流，同一清晰度有多种编码时返回接口给出的第一种"""
+        return next((i for i in self.video_streams if i.id == quality), None)
+
+    @property
+    def audio(self):
+        return self.audio_streams[0] if self.audio_streams else None
+
+    def estimate_size(self, stream):
+        """流的字节数：接口给出大小时直接使用，否则按码率和时长估算"""
+        if stream.size:
+            return stream.size
+        return int((stream.bandwidth or 0) * (self.duration or 0) / 8)
+
+
+# DASH 视频编码 codecid
+CODEC_NAMES = {7: 'avc', 12: 'hevc', 13: 'av1'}
+
+
+def codec_name(stream):
+    """视频流的编码名称：avc、hevc、av1，无法识别时返回 codecs 字段"""
+    if stream.codecid in CODEC_NAMES:
+        return CODEC_NAMES[stream.codecid]
+    codecs = (stream.codecs or '').lower()
+    for prefix, name in (('avc', 'avc'), ('hev', 'hevc'), ('hvc', 'hevc'), ('av01', 'av1')):
+        if codecs.startswith(prefix):
+            return name
+    return codecs
+
+
+class StreamSelector:
+    """
+    音视频流选择策略，在缓存的 PlayInfo 上求值
+    同一清晰度通常同时提供 AVC、HEVC、AV1 三种编码，体积差别很大；音频也有多种码率以及杜比/无损音轨
+    Args:
+        codecs: 可接受的视频编码，按偏好排序，如 ('hevc', 'avc')；为空表示全部可接受。
+                没有可接受的编码时退回到全部编码
+        prefer: 'codec' 按 codecs 顺序选择（codecs 为空时取接口给出的第一种，与之前的行为一致）；
+                'smallest' 在同一清晰度的可接受编码中选择体积最小的
+        audio: 'max' 最高码率，'min' 最低码率
+        lossless: 是否考虑杜比全景声/无损音轨
+        byte_budget: 音视频合计字节数上限，超出时逐级降低清晰度；都超出时选择体积最小的组合
+    """
+
+    def __init__(self, codecs=None, prefer='codec', audio='max', lossless=False, byte_budget=None):
+        self.codecs = tuple(codecs or ())
+        self.prefer = prefer
+        self.audio = audio
+        self.lossless = lossless
+        self.byte_budget = byte_budget
+
+    def select_audio(self, play_info):
+        candidates = list(play_info.audio_streams)
+        if not self.lossless:
+            candidates = [i for i in candidates if i not in play_info.special_audio_streams] or candidates
+        if not candidates:
+            return None
+        if self.audio == 'min':
+            return min(candidates, key=lambda i: i.bandwidth)
+        return max(candidates, key=lambda i: i.bandwidth)
+
+    def select_video(self, play_info, quality, budget=None):
+        """
+        不高于 quality 的最高清晰度中按策略选择一路视频流
+        指定 budget 时跳过估算大小超出预算的清晰度
+        """
+        streams = play_info.video_streams
+        if self.codecs:
+            streams = [i for i in streams if codec_name(i) in self.codecs] or streams
+        levels = sorted({i.id for i in streams}, reverse=True)
+        if not levels:
+            return None
+        allowed = [level for level in levels if level <= quality] or levels[-1:]
+        for level in allowed:
+            choice = self._pick([i for i in streams if i.id == level], play_info)
+            if budget is None or play_info.estimate_size(choice) <= budget:
+                return choice
+        # 所有清晰度都超出预算，选择体积最小的
+        return min(streams, key=play_info.estimate_size)
+
+    def _pick(self, streams, play_info):
+        if self.prefer == 'smallest':
+            return min(streams, key=play_info.estimate_size)
+        if self.codecs:
+            return min(streams, key=lambda i: self.codecs.index(codec_name(i))
+                       if codec_name(i) in self.codecs else len(self.codecs))
+        return streams[0]
+
+    def select(self, play_info, quality):
+        """
+        Returns:
+            tuple: (视频流, 音频流)，没有可用的流时对应项为 None
+        """
+        audio = self.select_audio(play_info)
+        budget = None
+        if self.byte_budget is not None:
+            budget = self.byte_budget - (play_info.estimate_size(audio) if audio else 0)
+        return self.select_video(play_info, quality, budget), audio
+
+
+class RateLimitError(Exception):
+    """接口持续返回限流/风控响应，退避重试后仍未恢复"""
+
+
+class ApiScheduler:
+    """
+    api.bilibili.com 请求的全局调度，进程内所有接口客户端（同步和异步）共用
+    - 令牌桶限制请求速率：遇到限流时速率减半，连续成功后逐步恢复（AIMD），
+      稳定在接口可以承受的最大速率附近
+    - 识别限流响应：HTTP 412/429，或返回码 -352/-412
+    - 限流后按指数退避并加随机抖动重试，避免多个请求同时重试再次触发限流
+    - 熔断：连续多次限流后暂停所有请求一段时间，到期后只放行一个探测请求，
+      探测成功才恢复
+    """
+
+    rate_limit_status = (412, 429)
+    rate_limit_codes = (-352, -412)
+    # 速率每次成功后的增量（次/秒）
+    rate_increase = 0.1
+    # 两次降速的最小间隔（秒）：同一波并发请求同时被限流只算一次
+    decrease_interval = 1.0
+    # 熔断后探测请求未返回时，其余请求的轮询间隔（秒）
+    probe_wait = 0.5
+
+    def __init__(self, rate=5.0, max_rate=20.0, burst=8, min_rate=0.5, max_retries=6, backoff_base=1.0,
+                 backoff_cap=60.0, failure_threshold=5, open_seconds=30.0):
+        self.max_rate = max(rate, max_rate)
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._consecutive_limited = 0
+        self._open_until = 0.0
+        self._probing = False
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def classify(self, status, data=None):
+        """判断一次响应是否为限流：返回 'rate_limited'、'ok' 或 'error'"""
+        if status in self.rate_limit_status:
+            return 'rate_limited'
+        if status != 200:
+            return 'error'
+        if isinstance(data, dict) and data.get('code') in self.rate_limit_codes:
+            return 'rate_limited'
+        return 'ok'
+
+    def _reserve(self):
+        """尝试取得一次请求的许可，返回需要等待的秒数，0 表示可以立即请求"""
+        with self._lock:
+            now = time.monotonic()
+            if self._open_until:
+                if now < self._open_until:
+                    return self._open_until - now
+                # 熔断到期：只放行一个探测请求
+                if self._probing:
+                    return self.probe_wait
+                self._probing = True
+                return 0
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_limited = 0
+            self._open_until = 0.0
+            self._probing = False
+            self.rate = min(self.max_rate, self.rate + self.rate_increase)
+
+    def record_rate_limited(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = 0.0
+            self._probing = False
+            if not self._open_until and now - self._last_decrease < self.decrease_interval:
+                return
+            self._last_decrease = now
+            self._consecutive_limited += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            if self._consecutive_limited >= self.failure_threshold:
+                self._open_until = now + self.open_seconds
+                print(f"接口连续限流，暂停请求 {self.open_seconds:.0f} 秒")
+            elif self._open_until:
+                # 探测请求仍被限流，重新熔断
+                self._open_until = now + self.open_seconds
+
+    def record_failure(self):
+        """
+        请求失败但不是限流（网络错误、超时、错误状态码、被取消）
+        熔断后的探测请求以这种方式结束时释放探测并重新熔断，否则其余请求会一直等待探测结果
+        """
+        with self._lock:
+            if self._probing:
+                self._probing = False
+                self._open_until = time.monotonic() + self.open_seconds
+
+    def backoff(self, attempt):
+        """第 attempt 次限流后的等待秒数：指数增长，随机取其 50%~100%"""
+        delay = min(self.backoff_cap, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+
+# 进程内共享的接口调度器
+api_scheduler = ApiScheduler()
+
+
+class WbiSigner:
+    """
+    WBI 签名（w_rid/wts）
+    img_key/sub_key 从 nav 接口获取，混合后的密钥缓存在内存中，指定 cache_path 时同时保存到磁盘，
+    有效期内签名不产生额外请求；密钥轮换导致签名被拒绝时作废缓存重新获取
+    """
+
+    api_nav = 'https://api.bilibili.com/x/web-interface/nav'
+    mixin_key_enc_tab = [
+        46, 47, 18, 2, 53, 8, 23, 32, 15, 50, 10, 31, 58, 3, 45, 35, 27, 43, 5, 49,
+        33, 9, 42, 19, 29, 28, 14, 39, 12, 38, 41, 13, 37, 48, 7, 16, 24, 55, 40,
+        61, 26, 17, 0, 1, 60, 51, 30, 4, 22, 25, 54, 21, 56, 59, 6, 63, 57, 62, 11,
+        36, 20, 34, 44, 52
+    ]
+    # 密钥缓存时间（秒），接口每天轮换密钥
+    key_lifetime = 12 * 3600
+    # 获取密钥失败后的冷却时间（秒），期间请求直接不带签名，不再每次先请求 nav
+    failure_lifetime = 60
+
+    def __init__(self, cache_path=None):
+        self.cache = TTLCache(maxsize=1, ttl=self.key_lifetime, path=cache_path)
+
+    def mixin_key(self):
+        """缓存的混合密钥，没有或已过期时返回 None，最近获取失败时返回空字符串（不签名）"""
+        return self.cache.get('mixin_key')
+
+    def update(self, nav):
+        """
+        从 nav 接口的响应中提取并缓存混合密钥（未登录时接口返回 -101，但仍包含密钥）
+        Returns:
+            str: 混合密钥，响应无效时为 None
+        """
+        try:
+            wbi_img = nav['data']['wbi_img']
+            img_key = wbi_img['img_url'].rsplit('/', 1)[1].split('.')[0]
+            sub_key = wbi_img['sub_url'].rsplit('/', 1)[1].split('.')[0]
+        except (TypeError, KeyError, IndexError):
+            print("获取WBI密钥失败，请求将不带签名")
+            # 短时间内记住失败，接口异常时不会让每个请求都多出一次 nav 请求
+            self.cache.set('mixin_key', '', ttl=self.failure_lifetime)
+            return None
+        key = self.get_mixin_key(img_key + sub_key)
+        self.cache.set('mixin_key', key)
+        return key
+
+    def invalidate(self):
+        # 获取失败的记录保留到冷却期结束
+        if self.cache.get('mixin_key'):
+            self.cache.invalidate('mixin_key')
+
+    @classmethod
+    def get_mixin_key(cls, orig):
+        """按固定顺序重排 img_key + sub_key，取前32位"""
+        return ''.join(orig[i] for i in cls.mixin_key_enc_tab)[:32]
+
+    @staticmethod
+    def sign(params, mixin_key, wts=None):
+        """
+        返回加上 wts 和 w_rid 的参数，mixin_key 为空时原样返回
+        参数按键名排序，值中的 !'()* 字符被去掉
+        """
+        params = dict(params or {})
+        if not mixin_key:
+            return params
+        params['wts'] = int(time.time()) if wts is None else wts
+        params = {k: ''.join(c for c in str(v) if c not in "!'()*") for k, v in sorted(params.items())}
+        params['w_rid'] = hashlib.md5((urlencode(params) + mixin_key).encode()).hexdigest()
+        return params
+
+
+class ApiClient:
+    """
+    api.bilibili.com 的同步客户端
+    基于 requests.Session 连接池，元数据请求复用同一批长连接；
+    请求头、cookie、超时、重试策略和调度器与 AsyncApiClient 共用
+    """
+
+    # 连接池大小
+    pool_maxsize = 16
+
+    def __init__(self, headers=None, cookies=None, retry_policy=None, scheduler=None, wbi_cache_path=None):
+        self.headers = headers or {}
+        self.cookies = cookies or {}
+        self.retry_policy = retry_policy or RetryPolicy(max_retries=3, backoff=1, timeout=10)
+        self.scheduler = scheduler or api_scheduler
+        self.wbi = WbiSigner(wbi_cache_path)
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_maxsize)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+            return self._session
+
+    def _wbi_key(self):
+        key = self.wbi.mixin_key()
+        if key is None:
+            key = self.wbi.update(self.get_json(self.wbi.api_nav))
+        return key
+
+    def get_json(self, url, params=None, wbi=False):
+        """
+        经调度器限速后请求接口并解析 JSON
+        限流响应按调度器的退避策略重试，网络错误和 5xx 按重试策略重试；
+        wbi 为真时每次请求都重新签名
+        Returns:
+            dict: 接口返回的 JSON，请求失败时为 None
+        Raises:
+            RateLimitError: 多次退避后仍被限流
+        """
+        policy = self.retry_policy
+        scheduler = self.scheduler
+        errors = 0
+        limited = 0
+        while True:
+            # 先取得签名密钥：获取密钥本身也要经过调度器，不能在占用许可（可能是熔断探测）时再等待
+            request_params = self.wbi.sign(params, self._wbi_key()) if wbi else params
+            scheduler.acquire()
+            data = None
+            try:
+                response = self.session.get(url, params=request_params, headers=self.headers, cookies=self.cookies,
+                                            timeout=policy.timeout_seconds(errors))
+                status = response.status_code
+                if status == 200:
+                    data = response.json()
+                error = f"状态码 {status}"
+            except (requests.RequestException, ValueError) as e:
+                status, error = None, str(e)
+            except BaseException:
+                scheduler.record_failure()
+                raise
+
+            kind = scheduler.classify(status, data)
+            if kind == 'ok':
+                scheduler.record_success()
+                return data
+            if kind == 'rate_limited':
+                scheduler.record_rate_limited()
+                limited += 1
+                if wbi and limited == 1:
+                    # 签名被拒绝也可能是密钥已经轮换
+                    self.wbi.invalidate()
+                if limited >= scheduler.max_retries:
+                    raise RateLimitError(f"请求过于频繁，已被限流: {url}")
+                time.sleep(scheduler.backoff(limited - 1))
+                continue
+            scheduler.record_failure()
+            errors += 1
+            if (status is not None and status < 500) or errors >= policy.max_retries:
+                print(f"请求接口失败: {error}")
+                return None
+            time.sleep(policy.delay(errors - 1))
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+class AsyncApiClient:
+    """
+    api.bilibili.com 的异步客户端（aiohttp）
+    请求头、cookie、超时、重试策略和调度器直接读取对应的 ApiClient，两者始终一致，
+    元数据解析可以和下载在同一个事件循环中并发进行
+    """
+
+    def __init__(self, client):
+        self.client = client
+        # 每个事件循环一个连接池（会话不能跨事件循环使用）
+        self._sessions = {}
+        # 正在进行的WBI密钥请求，并发的签名请求共用同一次获取
+        self._wbi_task = None
+
+    def _get_session(self):
+        loop = asyncio.get_running_loop()
+        for other in [other for other in self._sessions if other.is_closed()]:
+            del self._sessions[other]
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.client.pool_maxsize, ttl_dns_cache=300)
+            session = aiohttp.ClientSession(connector=connector)
+            self._sessions[loop] = session
+        return session
+
+    async def _wbi_key(self):
+        key = self.client.wbi.mixin_key()
+        if key is not None:
+            return key
+        task = self._wbi_task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = self._wbi_task = asyncio.ensure_future(self.get_json(self.client.wbi.api_nav))
+        return self.client.wbi.update(await task)
+
+    async def get_json(self, url, params=None, wbi=False):
+        """与 ApiClient.get_json 相同，请求失败时返回 None，持续限流时抛出 RateLimitError"""
+        policy = self.client.retry_policy
+        scheduler = self.client.scheduler
+        errors = 0
+        limited = 0
+        while True:
+            # 先取得签名密钥，原因同 ApiClient.get_json
+            request_params = self.client.wbi.sign(params, await self._wbi_key()) if wbi else params
+            await scheduler.acquire_async()
+            data = None
+            try:
+                session = self._get_session()
+                async with session.get(url, params=request_params, headers=self.client.headers,
+                                       cookies=self.client.cookies,
+                                       timeout=policy.request_timeout(errors)) as response:
+                    status = response.status
+                    if status == 200:
+                        data = await response.json(content_type=None)
+                    error = f"状态码 {status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                status, error = None, str(e) or type(e).__name__
+            except BaseException:
+                # 被取消时同样要释放熔断探测
+                scheduler.record_failure()
+                raise
+
+            kind = scheduler.classify(status, data)
+            if kind == 'ok':
+                scheduler.record_success()
+                return data
+            if kind == 'rate_limited':
+                scheduler.record_rate_limited()
+                limited += 1
+                if wbi and limited == 1:
+                    # 签名被拒绝也可能是密钥已经轮换
+                    self.client.wbi.invalidate()
+                if limited >= scheduler.max_retries:
+                    raise RateLimitError(f"请求过于频繁，已被限流: {url}")
+                await asyncio.sleep(scheduler.backoff(limited - 1))
+                continue
+            scheduler.record_failure()
+            errors += 1
+            if (status is not None and status < 500) or errors >= policy.max_retries:
+                print(f"请求接口失败: {error}")
+                return None
+            await asyncio.sleep(policy.delay(errors - 1))
+
+    async def close(self):
+        """关闭当前事件循环的连接池"""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
+
+
+# 批量解析的单条结果，失败时 error 为错误信息，其余字段可能为空
+ResolveResult = namedtuple('ResolveResult', ['source', 'bvid', 'title', 'cid', 'play_info', 'error'])
+
+
+class BulkResolver:
+    """
+    批量解析BV号
+    同时解析的数量不超过 concurrency，结果按完成顺序逐条产出，
+    单条失败只记录在结果中，不影响其余条目
+    """
+
+    def __init__(self, video, concurrency=8):
+        self.video = video
+        self.concurrency = concurrency
+
+    async def resolve_one(self, source, pages=1):
+        """解析一条输入：视频信息、分P的cid和播放信息"""
+        bvid = None
+        try:
+            bvid = extract_bv_number(source.strip())
+            info = await self.video.get_info_async(bvid)
+            if info is False:
+                return ResolveResult(source, bvid, None, None, None, "无效的BV号或获取视频信息失败")
+            cid = await self.video.get_cid_async(bvid, pages)
+            play_info = await self.video.get_play_info_async(bvid, cid)
+            if play_info is None:
+                return ResolveResult(source, bvid, info['data']['title'], cid, None, "获取播放信息失败")
+            return ResolveResult(source, bvid, info['data']['title'], cid, play_info, None)
+        except Exception as e:
+            return ResolveResult(source, bvid, None, None, None, str(e))
+
+    async def resolve(self, sources, pages=1):
+        """
+        异步生成器，逐条产出 ResolveResult
+        Args:
+            sources: BV号或链接的可迭代对象，也可以是异步可迭代对象（按需读取，不会一次性展开）
+            pages: 解析第几P
+        """
+        exhausted = object()
+        if hasattr(sources, '__aiter__'):
+            iterator = sources.__aiter__()
+
+            async def next_source():
+                try:
+                    return await iterator.__anext__()
+                except StopAsyncIteration:
+                    return exhausted
+        else:
+            iterator = iter(sources)
+
+            async def next_source():
+                return next(iterator, exhausted)
+
+        pending = set()
+        more = True
+        try:
+            while True:
+                # 补足到并发上限
+                while more and len(pending) < self.concurrency:
+                    source = await next_source()
+                    if source is exhausted:
+                        more = False
+                        break
+                    pending.add(asyncio.ensure_future(self.resolve_one(source, pages)))
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            # 提前结束或出错时关闭来源（如 SpaceEnumerator 的预取任务和未完成的请求）
+            if hasattr(iterator, 'aclose'):
+                await iterator.aclose()
+
+
+class SpaceEnumerator:
+    """
+    分页列举UP主投稿、收藏夹和合集中的视频
+    每个方法都是异步生成器，逐页请求并逐个产出BV号；产出当前页时已在后台请求下一页，
+    可直接交给 BiliVideoDownloader.download_videos，第一页到达后就开始下载
+    """
+
+    api_space = 'https://api.bilibili.com/x/space/wbi/arc/search'
+    api_favorites = 'https://api.bilibili.com/x/v3/fav/resource/list'
+    api_season = 'https://api.bilibili.com/x/polymer/web-space/seasons_archives_list'
+
+    def __init__(self, async_client, page_size=30):
+        self.client = async_client
+        self.page_size = page_size
+
+    def uploader_videos(self, mid):
+        """UP主的全部投稿（按发布时间倒序）"""
+        def request(pn):
+            return self.api_space, {'mid': mid, 'pn': pn, 'ps': self.page_size, 'order': 'pubdate'}
+
+        def parse(data):
+            vlist = (data.get('list') or {}).get('vlist') or []
+            page = data.get('page') or {}
+            return [i['bvid'] for i in vlist], len(vlist) > 0 and \
+                page.get('pn', 0) * page.get('ps', self.page_size) < page.get('count', 0)
+        return self._paginate(request, parse)
+
+    def favorites(self, media_id):
+        """收藏夹中的视频，失效视频会被跳过"""
+        def request(pn):
+            # 收藏夹接口每页最多20条
+            return self.api_favorites, {'media_id': media_id, 'pn': pn, 'ps': min(self.page_size, 20),
+                                        'platform': 'web'}
+
+        def parse(data):
+            medias = data.get('medias') or []
+            return [i['bvid'] for i in medias if i.get('bvid') and i.get('attr', 0) == 0], bool(data.get('has_more'))
+        return self._paginate(request, parse)
+
+    def season(self, mid, season_id):
+        """合集（视频列表）中的视频，按合集顺序"""
+        def request(pn):
+            return self.api_season, {'mid': mid, 'season_id': season_id, 'page_num': pn,
+                                     'page_size': self.page_size, 'sort_reverse': 'false'}
+
+        def parse(data):
+            archives = data.get('archives') or []
+            page = data.get('page') or {}
+            return [i['bvid'] for i in archives], len(archives) > 0 and \
+                page.get('page_num', 0) * page.get('page_size', self.page_size) < page.get('total', 0)
+        return self._paginate(request, parse)
+
+    async def _paginate(self, request, parse):
+        """
+        通用分页：request(pn) 返回 (url, params)，parse(data) 返回 (BV号列表, 是否还有下一页)
+        请求失败或接口返回错误时结束列举
+        """
+        async def fetch(pn):
+            url, params = request(pn)
+            return await self.client.get_json(url, params, wbi='/wbi/' in url)
+
+        pn = 1
+        task = asyncio.ensure_future(fetch(pn))
+        try:
+            while task is not None:
+                result = await task
+                task = None
+                if result is None or result.get('code') != 0:
+                    if result is not None:
+                        print(f"列举视频失败: {result.get('message')}")
+                    return
+                bvids, has_more = parse(result.get('data') or {})
+                if has_more:
+                    # 消费当前页的同时请求下一页
+                    pn += 1
+                    task = asyncio.ensure_future(fetch(pn))
+                for bvid in bvids:
+                    yield bvid
+        finally:
+            if task is not None:
+                task.cancel()
@@ -1,12 +1,20 @@
+import os
+import json
 import platform
 import shutil
 import tempfile
+import threading
 import urllib.request
 import zipfile
+from collections import namedtuple
 from pathlib import Path
 import subprocess
 
 
+# FFmpeg 的路径、版本号以及支持的封装格式（muxer）和编解码器名称
+FFmpegInfo = namedtuple('FFmpegInfo', ['path', 'version', 'muxers', 'codecs'])
+
+
 class FFmpegManager:
     FFMPEG_URLS = [
         'https://ghproxy.cn/https://github.com/BtbN/FFmpeg-Builds/releases/download/latest/ffmpeg-master-latest-win64-gpl.zip',
@@ -15,40 +23,18 @@ class FFmpegManager:
         'https://github.store/BtbN/FFmpeg-Builds/releases/download/latest/ffmpeg-master-latest-win64-gpl.zip',
     ]
 
-    def __init__(self):
-        if platform.system() != 'Windows':
-            raise RuntimeError("这个版本只服务于Windows系统")
-
+    def __init__(self, cache_path=None):
         # 设置FFmpeg路径
         self.base_path = Path(__file__).parent / 'ffmpeg'
         self.bin_path = self.base_path / 'bin'
-        self.ffmpeg_path = self.bin_path / 'ffmpeg.exe'
+        self.exe_name = 'ffmpeg.exe' if platform.system() == 'Windows' else 'ffmpeg'
+        self.ffmpeg_path = self.bin_path / self.exe_name
+        # 探测结果的磁盘缓存，按路径和文件修改时间判断是否有效
+        self.cache_path = cache_path
 
     def check_system_ffmpeg(self):
-        """检查系统是否已安装FFmpeg"""
-        try:
-            # 准备subprocess参数
-            kwargs = {
-                'capture_output': True,
-                'text': True
-            }
-            if platform.system() == 'Windows':
-                kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
-
-            # 检查环境变量中的ffmpeg
-            result = subprocess.run(['ffmpeg', '-version'], **kwargs)
-            if result.returncode == 0:
-                # 获取实际的ffmpeg路径
-                if platform.system() == 'Windows':
-                    result = subprocess.run(
-                        ['where', 'ffmpeg'],
-                        **kwargs
-                    )
-                    if result.returncode == 0:
-                        return result.stdout.strip().split('\n')[0]
-            return None
-        except:
-            return None
+        """检查系统是否已安装FFmpeg，在 PATH 中查找，不启动子进程"""
+        return shutil.which('ffmpeg')
 
     def ensure_ffmpeg(self):
         """确保FFmpeg可用，优先使用系统FFmpeg"""
@@ -65,8 +51,94 @@ class FFmpegManager:
 
         return None
 
+    def resolve(self):
+        """
+        查找FFmpeg并获取版本和支持的格式
+        同一个可执行文件（路径和修改时间不变）的探测结果从磁盘缓存读取，不再启动子进程
+        Returns:
+            FFmpegInfo 或 None（未找到或无法运行）
+        """
+        path = self.ensure_ffmpeg()
+        if not path:
+            return None
+        path = os.path.realpath(path)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        cache = self._load_cache()
+        entry = cache.get(path)
+        if entry and entry.get('mtime') == mtime:
+            return FFmpegInfo(path, entry['version'], entry['muxers'], entry['codecs'])
+
+        info = self.probe(path)
+        if info:
+            cache[path] = {'mtime': mtime, 'version': info.version, 'muxers': info.muxers, 'codecs': info.codecs}
+            self._save_cache(cache)
+        return info
+
+    def probe(self, path):
+        """运行 ffmpeg 获取版本号、muxer 和编解码器列表"""
+        kwargs = {
+            'capture_output': True,
+            'text': True
+        }
+        if platform.system() == 'Windows':
+            kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
+        try:
+            result = subprocess.run([path, '-version'], **kwargs)
+            if result.returncode != 0:
+                return None
+            first_line = result.stdout.split('\n', 1)[0].split()
+            version = first_line[2] if len(first_line) > 2 else ''
+            muxers = self._parse_list(subprocess.run([path, '-hide_banner', '-muxers'], **kwargs).stdout)
+            codecs = self._parse_list(subprocess.run([path, '-hide_banner', '-codecs'], **kwargs).stdout)
+            return FFmpegInfo(path, version, muxers, codecs)
+        except Exception as e:
+            print(f"检测FFmpeg失败: {str(e)}")
+            return None
+
+    @staticmethod
+    def _parse_list(output):
+        """解析 -muxers / -codecs 的输出：分隔线 -- 之后每行为 标志 名称 描述"""
+        names = []
+        started = False
+        for line in output.splitlines():
+            if not started:
+                started = line.strip() == '--' or line.strip().startswith('--')
+                continue
+            parts = line.split()
+            if len(parts) >= 2:
+                names.extend(parts[1].split(','))
+        return names
+
+    def _load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"读取FFmpeg缓存失败: {str(e)}")
+            return {}
+
+    def _save_cache(self, cache):
+        if not self.cache_path:
+            return
+        try:
+            temp_path = f"{self.cache_path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+            os.replace(temp_path, self.cache_path)
+        except Exception as e:
+            print(f"写入FFmpeg缓存失败: {str(e)}")
+
     def download_ffmpeg(self):
-        """下载并解压FFmpeg"""
+        """下载并解压FFmpeg（仅提供Windows版本）"""
+        if platform.system() != 'Windows':
+            raise RuntimeError("自动下载只支持Windows系统，请通过系统包管理器安装FFmpeg")
+
         for url in self.FFMPEG_URLS:
             try:
                 # 创建临时目录
@@ -109,13 +181,38 @@ class FFmpegManager:
         raise RuntimeError("FFmpeg下载或解压失败")
 
 
+# 默认的探测结果缓存文件
+FFMPEG_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".bilidownloader_ffmpeg.json")
+
+_resolved = {}
+_resolve_lock = threading.Lock()
+
+
+def resolve_ffmpeg(refresh=False):
+    """
+    获取FFmpeg信息，每个进程只查找一次，探测结果同时缓存在磁盘上
+    Args:
+        refresh: 重新查找（例如刚安装了FFmpeg）
+    Returns:
+        FFmpegInfo 或 None
+    """
+    with _resolve_lock:
+        if refresh or 'info' not in _resolved:
+            _resolved['info'] = FFmpegManager(FFMPEG_CACHE_PATH).resolve()
+        return _resolved['info']
+
+
 def get_ffmpeg():
     """获取FFmpeg路径的便捷函数"""
     manager = FFmpegManager()
     ffmpeg_path = manager.ensure_ffmpeg()
     if ffmpeg_path:
         return ffmpeg_path
-    return manager.download_ffmpeg()
+    ffmpeg_path = manager.download_ffmpeg()
+    # 新安装的FFmpeg在下次使用时重新探测
+    with _resolve_lock:
+        _resolved.clear()
+    return ffmpeg_path
 
 
 if __name__ == '__main__':
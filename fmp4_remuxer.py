@@ -0,0 +1,297 @@
+import os
+import heapq
+import struct
+
+
+class RemuxError(Exception):
+    """输入不是可以直接重封装的分片 MP4，需要交给 ffmpeg 处理"""
+
+
+class Box:
+    """MP4 box：类型、在文件中的位置和大小（含头部）"""
+
+    def __init__(self, type, offset, size, header_size):
+        self.type = type
+        self.offset = offset
+        self.size = size
+        self.header_size = header_size
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+
+def iter_boxes(f, start, end):
+    """遍历 [start, end) 范围内的同级 box"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise RemuxError(f"box 大小无效: {box_type!r} @ {pos}")
+        yield Box(box_type.decode('latin-1'), pos, size, header_size)
+        pos += size
+
+
+def read_box(f, box):
+    f.seek(box.offset)
+    return bytearray(f.read(box.size))
+
+
+def children(data, start=8):
+    """解析内存中 box 的子 box，返回 [(类型, 起始, 结束)]"""
+    result = []
+    pos = start
+    while pos + 8 <= len(data):
+        size, box_type = struct.unpack_from('>I4s', data, pos)
+        if size < 8 or pos + size > len(data):
+            raise RemuxError(f"box 大小无效: {box_type!r}")
+        result.append((box_type.decode('latin-1'), pos, pos + size))
+        pos += size
+    return result
+
+
+def find(data, path, start=8):
+    """按路径（如 'mdia/mdhd'）查找子 box，返回 (起始, 结束) 或 None"""
+    name, _, rest = path.partition('/')
+    for box_type, box_start, box_end in children(data, start):
+        if box_type == name:
+            if not rest:
+                return box_start, box_end
+            return find(data[:box_end], rest, box_start + 8)
+    return None
+
+
+def make_box(box_type, payload):
+    return struct.pack('>I4s', 8 + len(payload), box_type.encode('latin-1')) + bytes(payload)
+
+
+class Fragment:
+    """一个 moof 及其后紧跟的 mdat；decode_time 为 tfdt 换算成的秒数，用于两路交错"""
+
+    def __init__(self, track, moof, mdat, decode_time):
+        self.track = track
+        self.moof = moof
+        self.mdat = mdat
+        self.decode_time = decode_time
+
+
+class Track:
+    """单轨分片 MP4 输入：ftyp、trak、trex 以及所有分片"""
+
+    def __init__(self, path):
+        self.path = path
+        self.ftyp = None
+        self.trak = None
+        self.trex = None
+        self.mehd = None
+        self.movie_timescale = 0
+        self.timescale = 0
+        self.fragments = []
+        self.mvhd = None
+        self._parse()
+
+    def _parse(self):
+        with open(self.path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            pending_moof = None
+            for box in iter_boxes(f, 0, file_size):
+                if box.type == 'ftyp':
+                    self.ftyp = read_box(f, box)
+                elif box.type == 'moov':
+                    self._parse_moov(read_box(f, box))
+                elif box.type == 'moof':
+                    if pending_moof is not None:
+                        raise RemuxError("moof 后缺少 mdat")
+                    pending_moof = box
+                elif box.type == 'mdat':
+                    if pending_moof is None:
+                        raise RemuxError("mdat 前缺少 moof（不是分片 MP4）")
+                    self.fragments.append(self._fragment(f, pending_moof, box))
+                    pending_moof = None
+                # sidx、styp、mfra 等索引信息在合并后不再有效，直接丢弃
+        if self.trak is None or self.trex is None:
+            raise RemuxError("缺少 moov/mvex，不是分片 MP4")
+        if not self.fragments:
+            raise RemuxError("没有媒体分片")
+
+    def _parse_moov(self, moov):
+        traks = [(s, e) for t, s, e in children(moov) if t == 'trak']
+        if len(traks) != 1:
+            raise RemuxError("输入应当只包含一条轨道")
+        start, end = traks[0]
+        self.trak = moov[start:end]
+        mvhd = find(moov, 'mvhd')
+        if mvhd is None:
+            raise RemuxError("缺少 mvhd")
+        self.mvhd = moov[mvhd[0]:mvhd[1]]
+        self.movie_timescale = struct.unpack_from('>I', self.mvhd, 20 if self.mvhd[8] == 0 else 28)[0]
+        mdhd = find(self.trak, 'mdia/mdhd')
+        if mdhd is None:
+            raise RemuxError("缺少 mdhd")
+        offset = mdhd[0] + (20 if self.trak[mdhd[0] + 8] == 0 else 28)
+        self.timescale = struct.unpack_from('>I', self.trak, offset)[0]
+        if not self.timescale:
+            raise RemuxError("时间刻度无效")
+        if find(self.trak, 'tkhd') is None:
+            raise RemuxError("缺少 tkhd")
+        trex = find(moov, 'mvex/trex')
+        if trex is None:
+            raise RemuxError("缺少 trex")
+        self.trex = moov[trex[0]:trex[1]]
+        mehd = find(moov, 'mvex/mehd')
+        if mehd is not None:
+            self.mehd = moov[mehd[0]:mehd[1]]
+
+    def _fragment(self, f, moof_box, mdat_box):
+        if moof_box.end != mdat_box.offset:
+            raise RemuxError("moof 与 mdat 不相邻")
+        moof = read_box(f, moof_box)
+        trafs = [(s, e) for t, s, e in children(moof) if t == 'traf']
+        if len(trafs) != 1:
+            raise RemuxError("每个分片应当只有一个 traf")
+        tfdt = find(moof, 'traf/tfdt')
+        if tfdt is None:
+            raise RemuxError("缺少 tfdt")
+        if moof[tfdt[0] + 8] == 1:
+            decode_time = struct.unpack_from('>Q', moof, tfdt[0] + 12)[0]
+        else:
+            decode_time = struct.unpack_from('>I', moof, tfdt[0] + 12)[0]
+        return Fragment(self, moof, mdat_box, decode_time / self.timescale)
+
+
+def _set_track_id(data, box_start, track_id, offset_v0=12, offset_v1=12):
+    offset = box_start + (offset_v0 if data[box_start + 8] == 0 else offset_v1)
+    struct.pack_into('>I', data, offset, track_id)
+
+
+def _rescale(data, offset, size, scale):
+    fmt = '>I' if size == 4 else '>Q'
+    value = struct.unpack_from(fmt, data, offset)[0]
+    struct.pack_into(fmt, data, offset, min(int(value * scale), 0xFFFFFFFF if size == 4 else 2 ** 64 - 1))
+
+
+def _prepare_trak(track, track_id, movie_timescale):
+    """改写轨道编号，并把以影片时间刻度表示的时长（tkhd、elst）换算到输出影片的时间刻度"""
+    trak = bytearray(track.trak)
+    scale = movie_timescale / track.movie_timescale if track.movie_timescale else 1
+    tkhd = find(trak, 'tkhd')
+    _set_track_id(trak, tkhd[0], track_id, 20, 28)
+    if trak[tkhd[0] + 8] == 0:
+        _rescale(trak, tkhd[0] + 28, 4, scale)
+    else:
+        _rescale(trak, tkhd[0] + 36, 8, scale)
+    elst = find(trak, 'edts/elst')
+    if elst is not None and scale != 1:
+        version = trak[elst[0] + 8]
+        count = struct.unpack_from('>I', trak, elst[0] + 12)[0]
+        entry_size = 12 if version == 0 else 20
+        for i in range(count):
+            entry = elst[0] + 16 + i * entry_size
+            _rescale(trak, entry, 4 if version == 0 else 8, scale)
+    return trak
+
+
+def _copy_range(src, dst, offset, count):
+    """把 src 中 [offset, offset + count) 的数据追加到 dst，优先使用内核态复制"""
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while count > 0:
+                copied = os.copy_file_range(src_fd, dst_fd, count, offset)
+                if copied == 0:
+                    break
+                offset += copied
+                count -= copied
+            if count == 0:
+                return
+        except OSError:
+            pass
+    if hasattr(os, 'sendfile'):
+        try:
+            while count > 0:
+                sent = os.sendfile(dst_fd, src_fd, offset, count)
+                if sent == 0:
+                    break
+                offset += sent
+                count -= sent
+            if count == 0:
+                return
+        except OSError:
+            pass
+    src.seek(offset)
+    while count > 0:
+        data = src.read(min(count, 1024 * 1024))
+        if not data:
+            raise RemuxError("输入文件被截断")
+        dst.write(data)
+        count -= len(data)
+
+
+def remux(video_path, audio_path, output_path, progress_callback=None):
+    """
+    把单轨视频和单轨音频的分片 MP4（B站 DASH 的 m4s）合并为一个分片 MP4
+    只改写 box 头部信息（轨道编号、分片序号、绝对偏移），媒体数据按解码时间交错复制，
+    不解析也不修改任何帧；输入不符合预期时抛出 RemuxError
+    progress_callback(out_time, size): 每写完一个分片调用一次，参数为已输出的媒体时长（秒）和字节数
+    """
+    video = Track(video_path)
+    audio = Track(audio_path)
+    tracks = [video, audio]
+
+    movie_timescale = video.movie_timescale or video.timescale
+    moov = bytearray(video.mvhd)
+    # next_track_ID
+    struct.pack_into('>I', moov, len(moov) - 4, len(tracks) + 1)
+    mvex = bytearray()
+    if video.mehd is not None:
+        mvex += video.mehd
+    for track_id, track in enumerate(tracks, 1):
+        moov += _prepare_trak(track, track_id, movie_timescale)
+        trex = bytearray(track.trex)
+        struct.pack_into('>I', trex, 12, track_id)
+        mvex += trex
+    moov = make_box('moov', bytes(moov) + make_box('mvex', mvex))
+    new_ids = {id(track): track_id for track_id, track in enumerate(tracks, 1)}
+
+    temp_path = f"{output_path}.tmp"
+    try:
+        with open(video_path, 'rb') as video_file, open(audio_path, 'rb') as audio_file, \
+                open(temp_path, 'wb') as out:
+            files = {id(video): video_file, id(audio): audio_file}
+            out.write(video.ftyp or make_box('ftyp', b'iso5\x00\x00\x02\x00iso5iso6mp41'))
+            out.write(moov)
+            ordered = heapq.merge(*(track.fragments for track in tracks),
+                                  key=lambda frag: (frag.decode_time, new_ids[id(frag.track)]))
+            for sequence, frag in enumerate(ordered, 1):
+                moof_offset = out.tell()
+                moof = bytearray(frag.moof)
+                mfhd = find(moof, 'mfhd')
+                struct.pack_into('>I', moof, mfhd[0] + 12, sequence)
+                tfhd = find(moof, 'traf/tfhd')
+                struct.pack_into('>I', moof, tfhd[0] + 12, new_ids[id(frag.track)])
+                flags = struct.unpack_from('>I', moof, tfhd[0] + 8)[0] & 0xFFFFFF
+                if flags & 0x000001:
+                    # base-data-offset 是文件内的绝对位置，改为输出文件中的位置
+                    old_base = struct.unpack_from('>Q', moof, tfhd[0] + 16)[0]
+                    old_moof_offset = frag.mdat.offset - len(frag.moof)
+                    struct.pack_into('>Q', moof, tfhd[0] + 16, old_base - old_moof_offset + moof_offset)
+                out.write(moof)
+                out.flush()
+                _copy_range(files[id(frag.track)], out, frag.mdat.offset, frag.mdat.size)
+                out.seek(0, os.SEEK_END)
+                if progress_callback:
+                    progress_callback(frag.decode_time, out.tell())
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,1189 @@
+import os
+import time
+import json
+import random
+import asyncio
+import inspect
+import threading
+import aiohttp
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+
+# 进度事件：已下载字节数、总字节数、百分比、瞬时速度、平滑速度（字节/秒）、预计剩余秒数（未知时为None）
+ProgressEvent = namedtuple('ProgressEvent', ['downloaded', 'total', 'percentage', 'speed', 'smoothed_speed', 'eta'])
+
+
+class PreallocatedFileWriter:
+    """
+    预分配大小的输出文件，各分块按偏移量直接写入最终位置
+    取代“先写 .partN 分块文件再合并”的方式，每个字节只落盘一次
+    """
+
+    def __init__(self, filename, total_size):
+        self.filename = filename
+        self.total_size = total_size
+        self._fd = None
+        # 不支持 os.pwrite 的平台（Windows）需要串行化 seek + write
+        self._lock = threading.Lock()
+
+    async def open(self):
+        """打开文件并预分配到目标大小"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._open)
+        return self
+
+    def _open(self):
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        self._fd = os.open(self.filename, flags, 0o644)
+        if os.fstat(self._fd).st_size != self.total_size:
+            os.ftruncate(self._fd, self.total_size)
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self._fd, 0, self.total_size)
+            except OSError:
+                # 部分文件系统不支持预分配，退化为稀疏文件
+                pass
+
+    async def flush(self):
+        """将已写入的数据刷到磁盘"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, os.fsync, self._fd)
+
+    async def write_at(self, offset, data):
+        """在指定偏移量写入数据"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_at, offset, data)
+
+    def _write_at(self, offset, data):
+        view = memoryview(data)
+        if hasattr(os, 'pwrite'):
+            while view:
+                written = os.pwrite(self._fd, view, offset)
+                offset += written
+                view = view[written:]
+        else:
+            with self._lock:
+                os.lseek(self._fd, offset, os.SEEK_SET)
+                while view:
+                    written = os.write(self._fd, view)
+                    view = view[written:]
+
+    async def close(self):
+        """关闭文件"""
+        if self._fd is not None:
+            fd, self._fd = self._fd, None
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, os.close, fd)
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class DownloadJournal:
+    """
+    下载日志（与目标文件同名的 .journal 旁路文件）
+    记录文件总大小、ETag/Last-Modified 以及已确认写入的字节区间，
+    进程崩溃或分块重试耗尽后重新下载时，只需获取缺失的区间
+    """
+
+    # 日志最短落盘间隔（秒），避免每个数据块都写一次日志
+    flush_interval = 1.0
+
+    def __init__(self, filename, enabled=True):
+        self.path = f"{filename}.journal"
+        self.filename = filename
+        # 不可续传的下载（如直接输出到管道）不读写日志文件
+        self.enabled = enabled
+        self.total_size = 0
+        self.etag = None
+        self.last_modified = None
+        # 已完成的区间，元素为 [start, end)，保持有序且互不重叠
+        self.completed = []
+        # 已加载日志中记录的校验值，load 时没有校验值可比时由 validate 校验
+        self._saved_etag = None
+        self._saved_last_modified = None
+        self._last_flush = 0.0
+        self._dirty = False
+        self._flush_lock = asyncio.Lock()
+
+    def load(self, total_size, etag=None, last_modified=None):
+        """
+        读取已有日志，校验其是否仍对应同一个远端文件
+        Returns:
+            int: 可复用的已完成字节数，日志无效时为0
+        """
+        self.total_size = total_size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.completed = []
+        self._saved_etag = None
+        self._saved_last_modified = None
+        if not self.enabled:
+            return 0
+        try:
+            if not os.path.exists(self.path) or not os.path.exists(self.filename):
+                return 0
+            if os.path.getsize(self.filename) != total_size:
+                return 0
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('total_size') != total_size:
+                return 0
+            # 远端文件有变化时放弃旧进度
+            if etag and state.get('etag') and state['etag'] != etag:
+                return 0
+            if last_modified and state.get('last_modified') and state['last_modified'] != last_modified:
+                return 0
+            for start, end in state.get('completed', []):
+                self._add(int(start), int(end))
+            self._saved_etag = state.get('etag')
+            self._saved_last_modified = state.get('last_modified')
+        except Exception as e:
+            print(f"读取下载日志失败: {str(e)}")
+            self.completed = []
+        return self.completed_bytes()
+
+    def validate(self, etag=None, last_modified=None):
+        """
+        用第一个区间响应的 ETag/Last-Modified 校验已加载的进度
+        （下载源已给出大小时不探测，load 只能按大小校验），并记下校验值随日志保存
+        Returns:
+            bool: 远端文件有变化、已丢弃旧进度时为 False
+        """
+        changed = bool(etag and self._saved_etag and self._saved_etag != etag) or \
+            bool(last_modified and self._saved_last_modified and self._saved_last_modified != last_modified)
+        self.etag = etag or self.etag
+        self.last_modified = last_modified or self.last_modified
+        self._saved_etag = self.etag
+        self._saved_last_modified = self.last_modified
+        self._dirty = True
+        if changed:
+            self.completed = []
+        return not changed
+
+    def completed_bytes(self):
+        return sum(end - start for start, end in self.completed)
+
+    def _add(self, start, end):
+        if end <= start:
+            return
+        merged = []
+        for s, e in self.completed:
+            if e < start or s > end:
+                merged.append([s, e])
+            else:
+                start, end = min(s, start), max(e, end)
+        merged.append([start, end])
+        merged.sort()
+        self.completed = merged
+
+    def record(self, start, end):
+        """记录 [start, end) 区间已写入"""
+        self._add(start, end)
+        self._dirty = True
+
+    def missing(self):
+        """返回尚未完成的区间列表，元素为 (start, end)，end 不包含"""
+        gaps = []
+        pos = 0
+        for start, end in self.completed:
+            if start > pos:
+                gaps.append((pos, start))
+            pos = max(pos, end)
+        if pos < self.total_size:
+            gaps.append((pos, self.total_size))
+        return gaps
+
+    async def maybe_flush(self, writer):
+        """距离上次落盘超过 flush_interval 时保存日志"""
+        if self._dirty and time.monotonic() - self._last_flush >= self.flush_interval:
+            await self.flush(writer)
+
+    async def flush(self, writer=None):
+        """
+        保存日志
+        先把数据文件刷盘再原子替换日志，保证日志中记录的区间一定已经落盘
+        """
+        if not self._dirty or not self.enabled:
+            return
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        # 先取快照：刷盘期间新记录的区间留到下一次保存
+        state = {
+            'total_size': self.total_size,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'completed': [list(r) for r in self.completed]
+        }
+        async with self._flush_lock:
+            if writer is not None:
+                await writer.flush()
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write_state, state)
+
+    def _write_state(self, state):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        """下载完成后删除日志"""
+        self._dirty = False
+        for path in (self.path, f"{self.path}.tmp"):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                print(f"删除下载日志失败: {str(e)}")
+
+
+class RemoteFileChanged(Exception):
+    """续传时远端文件的 ETag/Last-Modified 与日志不一致，旧进度已丢弃，不应重试区间"""
+
+
+class ConcurrencyController:
+    """
+    自适应并发控制器（AIMD）
+    按采样窗口统计总吞吐量和错误数：
+    - 窗口内没有错误且吞吐量较上一次扩容前明显提升时，并发数加1（加性增）
+    - 窗口内出现错误（超时、限流、连接中断等）时，并发数乘以 decrease_factor（乘性减）
+    - 吞吐量不再提升时保持当前并发数
+    """
+
+    # 采样窗口长度（秒）
+    window = 2.0
+    # 吞吐量至少提升该比例才继续扩容
+    growth_threshold = 0.05
+    # 出错时的并发数缩减系数
+    decrease_factor = 0.5
+
+    def __init__(self, min_concurrency=2, max_concurrency=32, initial_concurrency=8):
+        if min_concurrency < 1 or max_concurrency < min_concurrency:
+            raise ValueError("并发数上下限设置无效")
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = min(max(initial_concurrency, min_concurrency), max_concurrency)
+        self.in_flight = 0
+        # 当前窗口的统计
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_errors = 0
+        self._window_busy = False
+        # 上一次扩容前的吞吐量，用于判断扩容是否有效
+        self._baseline = 0.0
+        self.throughput = 0.0
+        # 同一引擎可能同时被多个事件循环（线程）使用，名额计数由线程锁保护，
+        # 每个事件循环一个条件变量，释放名额时唤醒所有循环中的等待者
+        self._lock = threading.Lock()
+        self._conditions = {}
+
+    def _get_condition(self):
+        # 条件变量绑定事件循环，不能跨循环共用
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for other in [other for other in self._conditions if other.is_closed()]:
+                del self._conditions[other]
+            condition = self._conditions.get(loop)
+            if condition is None:
+                condition = self._conditions[loop] = asyncio.Condition()
+        return condition
+
+    @property
+    def per_connection_throughput(self):
+        """最近一个窗口内单连接的平均吞吐量（字节/秒）"""
+        return self.throughput / max(self.limit, 1)
+
+    def _try_acquire(self):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            if self.in_flight >= self.limit:
+                self._window_busy = True
+            return True
+
+    async def acquire(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(self._try_acquire)
+
+    async def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._wake()
+
+    def slot(self):
+        """占用一个连接名额：async with controller.slot(): ..."""
+        return _ControllerSlot(self)
+
+    def record(self, nbytes):
+        """记录成功接收的字节数"""
+        with self._lock:
+            self._window_bytes += nbytes
+            grown = self._maybe_adjust()
+        if grown:
+            self._wake()
+
+    def record_error(self):
+        """记录一次请求失败"""
+        with self._lock:
+            self._window_errors += 1
+            grown = self._maybe_adjust()
+        if grown:
+            self._wake()
+
+    def _maybe_adjust(self):
+        """窗口结束时调整并发数（调用时持有 _lock），返回是否扩容"""
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return False
+        throughput = self._window_bytes / elapsed
+        old_limit = self.limit
+        if self._window_errors:
+            self.limit = max(self.min_concurrency, int(self.limit * self.decrease_factor))
+            self._baseline = throughput
+        elif self._window_busy and throughput >= self._baseline * (1 + self.growth_threshold):
+            # 只有名额全部占满时扩容才有意义
+            self.limit = min(self.max_concurrency, self.limit + 1)
+            self._baseline = throughput
+        elif throughput < self._baseline * (1 - self.growth_threshold):
+            # 网络状况变差时降低基准，之后仍可重新扩容
+            self._baseline = throughput
+        self.throughput = throughput
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_errors = 0
+        self._window_busy = self.in_flight >= self.limit
+        return self.limit > old_limit
+
+    def _wake(self):
+        """有名额空出（或扩容）时唤醒所有事件循环中等待的请求"""
+        with self._lock:
+            conditions = list(self._conditions.items())
+        for loop, condition in conditions:
+            try:
+                loop.call_soon_threadsafe(self._schedule_notify, condition)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+    def _schedule_notify(self, condition):
+        asyncio.ensure_future(self._notify(condition))
+
+    @staticmethod
+    async def _notify(condition):
+        async with condition:
+            condition.notify_all()
+
+
+class _ControllerSlot:
+    def __init__(self, controller):
+        self.controller = controller
+
+    async def __aenter__(self):
+        await self.controller.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.controller.release()
+
+
+class StreamSource:
+    """
+    下载源描述：同一文件的镜像地址（主地址在前）和文件大小
+    大小未知时为 None，下载时由第一个分块请求的 Content-Range 得到并回填
+    """
+
+    def __init__(self, urls, size=None):
+        self.urls = [urls] if isinstance(urls, str) else list(urls)
+        self.size = size
+
+    @property
+    def url(self):
+        return self.urls[0]
+
+
+class RangeJob:
+    """一个待下载的文件：下载源、目标文件、写入器和续传日志"""
+
+    def __init__(self, source, filename, resumable=True):
+        self.source = source if isinstance(source, StreamSource) else StreamSource(source)
+        self.urls = self.source.urls
+        self.filename = filename
+        self.journal = DownloadJournal(filename, resumable)
+        self.writer = None
+        self.total_size = 0
+        self.downloaded = 0
+        # 大小探测请求的响应：(镜像地址, 响应, 开始时间)，其数据直接作为第一个区间写入
+        self.probe = None
+        # 是否已用响应头中的 ETag/Last-Modified 校验过续传日志
+        self.validated = False
+
+
+class RangeSegment:
+    """待下载的字节区间 [start, end)，pos 为已连续写入到的位置"""
+
+    def __init__(self, index, start, end, job=None):
+        self.index = index
+        self.job = job
+        self.start = start
+        self.pos = start
+        self.end = end
+        # 正在下载该区间的请求，区间完成时取消其余冗余请求
+        self.fetchers = set()
+        self.workers = 0
+        # 已经发出的请求（大小探测），第一次下载该区间时直接读取其响应
+        self.prefetched = None
+
+    @property
+    def remaining(self):
+        return max(self.end - self.pos, 0)
+
+    @property
+    def done(self):
+        return self.pos >= self.end
+
+
+class RangeScheduler:
+    """
+    动态区间调度（工作窃取）
+    空闲的下载协程优先领取未开始的区间；没有时把剩余字节最多的区间从中点切开，
+    接手后半段；剩余字节很少时可再发起一个冗余请求与原请求赛跑，
+    使整体完成时间取决于总带宽而不是最慢的那条连接
+    """
+
+    def __init__(self, min_split_size=1024 * 1024, hedge=True):
+        self.min_split_size = min_split_size
+        self.hedge = hedge
+        self.pending = []
+        self.active = []
+        self._next_index = 0
+
+    def add(self, gaps, chunk_size, job=None):
+        """按 chunk_size 切分待下载区间并加入队列，多个文件可共用一个调度器"""
+        segments = []
+        for gap_start, gap_end in gaps:
+            for start in range(gap_start, gap_end, chunk_size):
+                segments.append(RangeSegment(self._next_index, start, min(start + chunk_size, gap_end), job))
+                self._next_index += 1
+        self.pending.extend(segments)
+        return segments
+
+    def add_first(self, start, end, job=None):
+        """加入一个优先领取的区间（已有请求在传输数据，不能让它空等）"""
+        seg = RangeSegment(self._next_index, start, end, job)
+        self._next_index += 1
+        self.pending.insert(0, seg)
+        return seg
+
+    def interleave(self):
+        """按区间在各自文件中的相对位置重新排列待下载队列（稳定排序，优先区间保持在前）"""
+        self.pending.sort(key=lambda seg: seg.start / seg.job.total_size if seg.job and seg.job.total_size else 0)
+
+    def next_segment(self):
+        """为空闲的下载协程分配一个区间，没有可做的工作时返回None"""
+        self.active = [seg for seg in self.active if not seg.done]
+        if self.pending:
+            seg = self.pending.pop(0)
+        else:
+            seg = self._steal() or self._hedge()
+            if seg is None:
+                return None
+        if seg not in self.active:
+            self.active.append(seg)
+        seg.workers += 1
+        return seg
+
+    def _steal(self):
+        """拆分剩余最多的区间，返回新的后半段"""
+        victim = max(self.active, key=lambda s: s.remaining, default=None)
+        if victim is None or victim.remaining < self.min_split_size * 2:
+            return None
+        middle = victim.pos + victim.remaining // 2
+        seg = RangeSegment(self._next_index, middle, victim.end, victim.job)
+        self._next_index += 1
+        victim.end = middle
+        return seg
+
+    def _hedge(self):
+        """为只剩少量字节的区间再发起一个冗余请求"""
+        if not self.hedge:
+            return None
+        candidates = [s for s in self.active if s.workers == 1 and s.remaining > 0]
+        return max(candidates, key=lambda s: s.remaining, default=None)
+
+    @staticmethod
+    def advance(seg, offset):
+        """
+        某个请求已写入到 offset，推进区间进度
+        Returns:
+            int: 新确认的字节数（冗余请求重复写入的部分不计入）
+        """
+        new_pos = min(max(seg.pos, offset), seg.end)
+        credited = new_pos - seg.pos
+        seg.pos = new_pos
+        return credited
+
+    def release(self, seg):
+        """下载协程结束对该区间的处理"""
+        seg.workers -= 1
+        if seg.done:
+            for fetcher in list(seg.fetchers):
+                fetcher.cancel()
+
+
+class HostScoreboard:
+    """
+    CDN 主机评分表
+    记录每个主机的单连接吞吐量（指数滑动平均）和连续失败次数，
+    同一个流的镜像地址按分数加权选择，失败的主机进入冷却期
+    """
+
+    # 吞吐量滑动平均的权重
+    smoothing = 0.3
+    # 每次连续失败增加的冷却时间（秒）
+    cooldown = 5.0
+
+    def __init__(self):
+        self.hosts = {}
+
+    @staticmethod
+    def host_of(url):
+        return urlsplit(url).netloc
+
+    def _stats(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {'throughput': None, 'failures': 0, 'active': 0, 'cooldown_until': 0.0}
+        return self.hosts[host]
+
+    def score(self, host):
+        stats = self._stats(host)
+        if stats['throughput'] is None:
+            # 未测速的主机优先尝试
+            return float('inf')
+        return stats['throughput'] * 0.5 ** stats['failures'] / (1 + stats['active'])
+
+    def pick(self, urls):
+        """从镜像地址中选择一个，优先分数高且不在冷却期的主机"""
+        candidates = self.available(urls)
+        if not candidates:
+            # 全部在冷却期时选择最早恢复的主机
+            return min(urls, key=lambda u: self._stats(self.host_of(u))['cooldown_until'])
+        scores = [self.score(self.host_of(u)) for u in candidates]
+        # 未测速的主机先各试探少量连接，避免把所有请求压到一个未知主机上
+        untested = [u for u, score in zip(candidates, scores)
+                    if score == float('inf') and self._stats(self.host_of(u))['active'] < 2]
+        if untested:
+            return min(untested, key=lambda u: self._stats(self.host_of(u))['active'])
+        finite = [score for score in scores if score != float('inf')]
+        fallback = max(finite) if finite else 1.0
+        weights = [fallback if score == float('inf') else score for score in scores]
+        if not any(weights):
+            return random.choice(candidates)
+        return random.choices(candidates, weights=weights)[0]
+
+    def begin(self, url):
+        self._stats(self.host_of(url))['active'] += 1
+
+    def end(self, url, nbytes, elapsed, failed=False):
+        """一次请求结束，更新该主机的吞吐量和失败记录"""
+        stats = self._stats(self.host_of(url))
+        stats['active'] = max(stats['active'] - 1, 0)
+        if nbytes and elapsed > 0:
+            throughput = nbytes / elapsed
+            if stats['throughput'] is None:
+                stats['throughput'] = throughput
+            else:
+                stats['throughput'] += self.smoothing * (throughput - stats['throughput'])
+        if failed:
+            self.record_failure(url)
+        elif nbytes:
+            stats['failures'] = 0
+
+    def record_failure(self, url):
+        """记录主机失败，连续失败次数越多冷却越久"""
+        stats = self._stats(self.host_of(url))
+        stats['failures'] += 1
+        stats['cooldown_until'] = time.monotonic() + self.cooldown * stats['failures']
+
+    def available(self, urls):
+        """返回不在冷却期的镜像地址"""
+        now = time.monotonic()
+        return [u for u in urls if self._stats(self.host_of(u))['cooldown_until'] <= now]
+
+
+class ProgressTracker:
+    """
+    进度汇总与限频发布
+    下载循环中只做字节累加，按 interval 间隔向回调发布一次 ProgressEvent，
+    避免每个数据块都触发回调、界面信号或终端输出
+    """
+
+    # 发布间隔（秒）
+    interval = 0.2
+    # 平滑速度的权重
+    smoothing = 0.3
+
+    def __init__(self, callback=None, total=0, interval=None):
+        self.callback = callback
+        self.total = total
+        self.downloaded = 0
+        if interval is not None:
+            self.interval = interval
+        self.smoothed_speed = 0.0
+        self._last_time = time.monotonic()
+        self._last_downloaded = 0
+
+    def start(self, downloaded=0, total=None):
+        """开始计时，downloaded 为续传时已有的字节数"""
+        if total is not None:
+            self.total = total
+        self.downloaded = downloaded
+        self._last_downloaded = downloaded
+        self._last_time = time.monotonic()
+
+    def update(self, nbytes):
+        """累加新下载的字节数，到达发布间隔时发布进度"""
+        self.downloaded += nbytes
+        if time.monotonic() - self._last_time >= self.interval:
+            self.publish()
+
+    def publish(self, force=False):
+        """计算速度和剩余时间并调用回调"""
+        now = time.monotonic()
+        elapsed = now - self._last_time
+        if elapsed <= 0 and not force:
+            return
+        speed = (self.downloaded - self._last_downloaded) / elapsed if elapsed > 0 else 0.0
+        if self.smoothed_speed:
+            self.smoothed_speed += self.smoothing * (speed - self.smoothed_speed)
+        else:
+            self.smoothed_speed = speed
+        self._last_time = now
+        self._last_downloaded = self.downloaded
+
+        remaining = max(self.total - self.downloaded, 0)
+        eta = remaining / self.smoothed_speed if self.smoothed_speed > 0 else None
+        percentage = min(100.0, self.downloaded * 100 / self.total) if self.total else 0.0
+        event = ProgressEvent(self.downloaded, self.total, percentage, speed, self.smoothed_speed, eta)
+        if self.callback:
+            try:
+                result = self.callback(event)
+                if inspect.isawaitable(result):
+                    asyncio.ensure_future(result)
+            except Exception as e:
+                print(f"进度回调出错: {str(e)}")
+
+    def finish(self):
+        """下载结束时发布最终进度"""
+        self.publish(force=True)
+
+
+class BandwidthLimiter:
+    """
+    全局带宽限制（令牌桶）
+    进程内所有下载任务共用同一个限速器，总速率按各任务的权重分配给各自的令牌桶，
+    一个大任务不会挤占其他任务的带宽；速率可在下载过程中随时调整
+    不依赖事件循环，可同时被多个线程中的事件循环使用
+    """
+
+    # 令牌桶容量对应的秒数，限制空闲后的突发流量
+    burst_seconds = 0.5
+    min_burst = 64 * 1024
+    # 等待令牌时的最长单次休眠（秒），保证调整速率后能很快生效
+    max_wait = 0.2
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.shares = []
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        """设置总速率（字节/秒），0 或 None 表示不限速"""
+        with self._lock:
+            self.rate = rate or 0
+            self._rebalance()
+
+    def register(self, weight=1.0):
+        """登记一个下载任务，返回其带宽份额"""
+        if weight <= 0:
+            raise ValueError("带宽权重必须大于0")
+        share = BandwidthShare(self, weight)
+        with self._lock:
+            self.shares.append(share)
+            self._rebalance()
+        return share
+
+    def unregister(self, share):
+        with self._lock:
+            if share in self.shares:
+                self.shares.remove(share)
+                self._rebalance()
+
+    def _rebalance(self):
+        total_weight = sum(share.weight for share in self.shares)
+        for share in self.shares:
+            share._refill()
+            share.rate = self.rate * share.weight / total_weight if self.rate else 0
+            share.capacity = max(share.rate * self.burst_seconds, self.min_burst)
+            share.tokens = min(share.tokens, share.capacity)
+
+
+class BandwidthShare:
+    """单个下载任务的带宽份额"""
+
+    def __init__(self, limiter, weight):
+        self.limiter = limiter
+        self.weight = weight
+        self.rate = 0
+        self.capacity = 0
+        self.tokens = 0.0
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.tokens + (now - self._updated) * self.rate, self.capacity)
+        self._updated = now
+
+    async def acquire(self, nbytes):
+        """
+        取得 nbytes 字节的发送额度
+        令牌有余额即放行并允许透支，透支部分由后续请求等待偿还，因此大数据块也能通过
+        """
+        limiter = self.limiter
+        while True:
+            with limiter._lock:
+                if not self.rate:
+                    return
+                self._refill()
+                if self.tokens > 0:
+                    self.tokens -= nbytes
+                    return
+                wait = min(-self.tokens / self.rate, limiter.max_wait)
+            await asyncio.sleep(max(wait, 0.001))
+
+    def close(self):
+        self.limiter.unregister(self)
+
+
+# 进程内共享的带宽限制器
+bandwidth_limiter = BandwidthLimiter()
+
+
+def format_size(bit):
+    """把字节数格式化为带单位的字符串"""
+    value = float(bit)
+    units = ["B", "KB", "MB", "GB", "TB", "PB"]
+    size = 1024.0
+    for i in range(len(units)):
+        if (value / size) < 1 or i == len(units) - 1:
+            return "%.2f%s" % (value, units[i])
+        value = value / size
+
+
+class ChunkPolicy:
+    """分块策略：初始分块大小，以及工作窃取时区间的最小拆分粒度和是否发起冗余请求"""
+
+    def __init__(self, chunk_count=32, min_chunk_size=5 * 1024 * 1024, min_split_size=1024 * 1024, hedge=True):
+        self.chunk_count = chunk_count
+        self.min_chunk_size = min_chunk_size
+        self.min_split_size = min_split_size
+        self.hedge = hedge
+
+    def chunk_size(self, total_size, max_concurrency):
+        """根据文件大小计算分块大小，保证分块数足以填满并发上限"""
+        chunk_count = max(self.chunk_count, max_concurrency * 2)
+        return max(total_size // chunk_count, self.min_chunk_size)
+
+    def create_scheduler(self):
+        return RangeScheduler(self.min_split_size, self.hedge)
+
+
+class RetryPolicy:
+    """重试策略：最大尝试次数、退避时间和每次请求的超时时间"""
+
+    def __init__(self, max_retries=5, backoff=2, timeout=30):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def delay(self, retry):
+        """第 retry 次失败后的等待秒数"""
+        return (retry + 1) * self.backoff
+
+    def timeout_seconds(self, retry):
+        """第 retry 次尝试的超时秒数，逐次放宽"""
+        return self.timeout * (retry + 1)
+
+    def request_timeout(self, retry):
+        """第 retry 次尝试的 aiohttp 超时设置"""
+        return aiohttp.ClientTimeout(total=self.timeout_seconds(retry))
+
+
+class RangeDownloader:
+    """
+    分段下载引擎
+    提供异步接口 download / download_many 和同步包装 download_sync，
+    分块、重试、写入和进度输出都可以通过策略对象替换：
+    - chunk_policy: ChunkPolicy，初始分块与工作窃取参数
+    - retry_policy: RetryPolicy，重试次数、退避和超时
+    - writer_factory: writer_factory(filename, total_size) 返回带 open/write_at/flush/close 的写入器
+    - progress_callback: 接收 ProgressEvent 的回调，按固定间隔发布
+    引擎持有连接池、并发控制器和主机评分，在多个文件和多次下载之间复用
+    """
+
+    # 连接池参数：同一CDN主机的最大连接数、DNS缓存时间、空闲连接保活时间
+    connection_limit = 64
+    connection_limit_per_host = 16
+    dns_cache_ttl = 300
+    keepalive_timeout = 60
+    # 每次从响应中读取的数据块大小
+    read_size = 1024 * 1024
+
+    def __init__(self, min_concurrency=2, max_concurrency=32, chunk_policy=None, retry_policy=None,
+                 writer_factory=PreallocatedFileWriter, bandwidth=None):
+        self.chunk_policy = chunk_policy or ChunkPolicy()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.writer_factory = writer_factory
+        # 同一引擎的所有文件共用一个并发控制器，吞吐量统计跨任务保留
+        self.concurrency = ConcurrencyController(min_concurrency, max_concurrency)
+        # CDN 主机评分同样跨任务保留
+        self.hosts = HostScoreboard()
+        # 带宽限制器默认在进程内所有引擎之间共享
+        self.bandwidth = bandwidth or bandwidth_limiter
+        # 每个事件循环一个连接池（会话不能跨事件循环使用）
+        self._sessions = {}
+        # 同步接口使用的事件循环
+        self._loop = None
+
+    def _get_session(self):
+        """
+        获取当前事件循环的长连接会话
+        所有分块、多个文件以及后续任务共用一个连接池，
+        避免每个分块都重新进行DNS解析和TCP/TLS握手
+        """
+        loop = asyncio.get_running_loop()
+        # 丢弃已关闭事件循环的会话
+        for other in [other for other in self._sessions if other.is_closed()]:
+            del self._sessions[other]
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            # 连接数上限不低于并发控制器的上限，否则扩容出的名额只会在连接池中排队
+            max_concurrency = self.concurrency.max_concurrency
+            connector = aiohttp.TCPConnector(
+                limit=max(self.connection_limit, max_concurrency),
+                limit_per_host=max(self.connection_limit_per_host, max_concurrency),
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+                enable_cleanup_closed=True
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            self._sessions[loop] = session
+        return session
+
+    async def close(self):
+        """关闭当前事件循环的连接池"""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def download_sync(self, files, headers=None, cookies=None, progress_callback=None, weight=1.0):
+        """同步接口：在引擎自有的事件循环中执行 download_many，连接池在多次调用之间保留"""
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(
+            self.download_many(files, headers, cookies, progress_callback, weight))
+
+    def close_sync(self):
+        """关闭同步接口使用的连接池和事件循环"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.run_until_complete(self.close())
+            self._loop.close()
+        self._loop = None
+
+    async def download(self, url, filename, headers=None, cookies=None, progress_callback=None, weight=1.0):
+        """
+        下载单个文件
+        Args:
+            url: 下载链接，也可以是同一文件的多个镜像地址列表（主地址在前）
+            filename: 保存的文件名
+        Returns:
+            bool: 下载是否成功
+        """
+        return await self.download_many([(url, filename)], headers, cookies, progress_callback, weight)
+
+    async def download_many(self, files, headers=None, cookies=None, progress_callback=None, weight=1.0,
+                            writer_factory=None, resumable=True):
+        """
+        在同一个区间调度器和连接预算下并发下载多个文件
+        空闲的下载协程可以接手任意文件中剩余的区间，一个文件的尾部不会让连接闲置
+        Args:
+            files: (source, filename) 列表，source 为 StreamSource，也可以是下载链接或镜像地址列表
+            headers: 请求头
+            cookies: cookie信息
+            progress_callback: 进度回调函数，参数为 ProgressEvent，按所有文件实际下载的字节数限频发布
+            weight: 限速时本任务的带宽权重
+            writer_factory: 本次下载使用的写入器工厂，默认使用引擎的 writer_factory
+            resumable: 是否写入续传日志，写入器不是普通文件时应为 False
+        Returns:
+            bool: 是否全部下载成功
+        """
+        headers = headers or {}
+        cookies = cookies or {}
+        writer_factory = writer_factory or self.writer_factory
+        jobs = [RangeJob(url, filename, resumable) for url, filename in files]
+        tracker = ProgressTracker(progress_callback)
+        share = self.bandwidth.register(weight)
+        scheduler = self.chunk_policy.create_scheduler()
+        retry_policy = self.retry_policy
+        controller = self.concurrency
+        tasks = []
+
+        async def probe(job):
+            """
+            大小未知时发出第一个分块请求，由 Content-Range 得到文件总大小
+            以及用于校验续传的 ETag/Last-Modified，响应体留给第一个区间读取，
+            不再额外发送 HEAD 请求；主地址失败时依次尝试镜像
+            """
+            probe_end = self.chunk_policy.min_chunk_size
+            probe_headers = headers.copy()
+            probe_headers['Range'] = f'bytes=0-{probe_end - 1}'
+            for mirror in job.urls:
+                response = None
+                try:
+                    session = self._get_session()
+                    started = time.monotonic()
+                    response = await session.get(mirror, headers=probe_headers, cookies=cookies,
+                                                 timeout=retry_policy.request_timeout(0))
+                    if response.status != 206:
+                        raise Exception(f"服务器不支持断点续传: {response.status}")
+                    total = response.headers.get('content-range', '').rpartition('/')[2]
+                    if not total.isdigit() or not int(total):
+                        raise Exception("响应缺少 Content-Range")
+                    job.probe = (mirror, response, started)
+                    return int(total), response.headers.get('etag'), response.headers.get('last-modified')
+                except Exception as e:
+                    if response is not None:
+                        response.close()
+                    self.hosts.record_failure(mirror)
+                    print(f"获取文件大小失败({self.hosts.host_of(mirror)}): {str(e)}")
+            return 0, None, None
+
+        async def get_file_info(job):
+            """下载源已知大小时直接使用，否则探测"""
+            if job.source.size:
+                return job.source.size, None, None
+            return await probe(job)
+
+        async def fetch_range(seg, retry):
+            """
+            从区间当前位置请求到区间末尾
+            区间在下载过程中可能被其他协程拆分而缩短，超出部分不再写入
+            """
+            job = seg.job
+            offset = seg.pos
+            received = 0
+            failed = False
+            if seg.prefetched is not None:
+                # 大小探测时已经发出的请求，直接读取其响应
+                mirror, request, started = seg.prefetched
+                seg.prefetched = None
+            else:
+                chunk_headers = headers.copy()
+                chunk_headers['Range'] = f'bytes={offset}-{seg.end - 1}'
+                # 按主机评分选择镜像，出错的主机会进入冷却期，重试时自动切换到其他镜像
+                mirror = self.hosts.pick(job.urls)
+                started = time.monotonic()
+                request = self._get_session().get(mirror, headers=chunk_headers, cookies=cookies,
+                                                  timeout=retry_policy.request_timeout(retry))
+            self.hosts.begin(mirror)
+            try:
+                async with request as response:
+                    if response.status != 206:
+                        raise Exception(f"服务器不支持断点续传: {response.status}")
+                    if not job.validated:
+                        # 第一个到达的响应在写入任何数据前校验续传日志
+                        job.validated = True
+                        if not job.journal.validate(response.headers.get('etag'),
+                                                    response.headers.get('last-modified')):
+                            raise RemoteFileChanged(
+                                f"远端文件已变化，已丢弃断点记录: {os.path.basename(job.filename)}")
+
+                    # 直接写入最终文件中该区间对应的偏移位置
+                    async for data in response.content.iter_chunked(self.read_size):
+                        size = min(len(data), seg.end - offset)
+                        if size <= 0:
+                            break
+                        await share.acquire(size)
+                        await job.writer.write_at(offset, data[:size])
+                        job.journal.record(offset, offset + size)
+                        offset += size
+                        received += size
+                        credited = scheduler.advance(seg, offset)
+                        job.downloaded += credited
+                        tracker.update(credited)
+                        controller.record(size)
+                        await job.journal.maybe_flush(job.writer)
+                        if offset >= seg.end:
+                            break
+
+                if offset < seg.end and not seg.done:
+                    raise Exception("连接提前关闭，数据不完整")
+            except Exception:
+                failed = True
+                raise
+            finally:
+                self.hosts.end(mirror, received, time.monotonic() - started, failed)
+
+        async def download_segment(seg):
+            """
+            下载一个区间，失败时从已确认写入的位置继续重试
+            调用前已占用一个并发名额，重试等待期间释放名额
+            """
+            held = True
+            try:
+                for retry in range(retry_policy.max_retries):
+                    if not held:
+                        await controller.acquire()
+                        held = True
+                    fetcher = asyncio.ensure_future(fetch_range(seg, retry))
+                    seg.fetchers.add(fetcher)
+                    try:
+                        await fetcher
+                        return
+                    except asyncio.CancelledError:
+                        # 冗余请求的另一方已完成该区间
+                        if seg.done and fetcher.cancelled():
+                            return
+                        raise
+                    except RemoteFileChanged:
+                        raise
+                    except Exception as e:
+                        if seg.done:
+                            return
+                        controller.record_error()
+                        await controller.release()
+                        held = False
+                        if retry < retry_policy.max_retries - 1:
+                            if self.hosts.available(seg.job.urls):
+                                # 还有可用的镜像，立即切换而不等待
+                                print(f"\n下载块 {seg.index} 失败: {str(e)}, 切换镜像重试...")
+                                continue
+                            wait_time = retry_policy.delay(retry)
+                            print(f"\n下载块 {seg.index} 失败: {str(e)}, {wait_time}秒后重试...")
+                            await asyncio.sleep(wait_time)
+                        else:
+                            print(f"\n下载块 {seg.index} 最终失败: {str(e)}")
+                            raise
+                    finally:
+                        seg.fetchers.discard(fetcher)
+            finally:
+                if held:
+                    await controller.release()
+                scheduler.release(seg)
+
+        async def worker():
+            """下载协程：不断领取区间，没有剩余工作时退出"""
+            while True:
+                await controller.acquire()
+                seg = scheduler.next_segment()
+                if seg is None:
+                    await controller.release()
+                    return
+                await download_segment(seg)
+
+        try:
+            # 获取各文件大小
+            infos = await asyncio.gather(*(get_file_info(job) for job in jobs))
+            for job, (total_size, etag, last_modified) in zip(jobs, infos):
+                if total_size == 0:
+                    raise Exception(f"无法获取文件大小: {os.path.basename(job.filename)}")
+                job.total_size = total_size
+                job.source.size = total_size
+
+                # 确保目标目录存在
+                directory = os.path.dirname(job.filename)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+
+                # 读取下载日志，跳过上次已完成的区间
+                job.downloaded = job.journal.load(total_size, etag, last_modified)
+                # 探测响应的校验值已在 load 中比较过，否则由第一个区间响应校验
+                job.validated = bool(etag or last_modified)
+                if job.downloaded:
+                    print(f"从上次中断处继续下载: {format_size(job.downloaded)}/{format_size(total_size)}")
+
+                # 预分配输出文件，各区间直接写入对应偏移
+                job.writer = await writer_factory(job.filename, total_size).open()
+
+                # 只调度缺失的区间
+                gaps = job.journal.missing()
+                if job.probe is not None and gaps and gaps[0][0] == 0:
+                    # 探测请求返回的正是文件开头，作为第一个区间直接写入
+                    probe_end = min(gaps[0][1], self.chunk_policy.min_chunk_size)
+                    seg = scheduler.add_first(0, probe_end, job)
+                    seg.prefetched = job.probe
+                    job.probe = None
+                    gaps[0] = (probe_end, gaps[0][1])
+                elif job.probe is not None:
+                    # 文件开头已经下载过，探测响应用不上，立即关闭，不占用连接到下载结束
+                    job.probe[1].close()
+                    job.probe = None
+                chunk_size = self.chunk_policy.chunk_size(total_size, controller.max_concurrency)
+                scheduler.add([gap for gap in gaps if gap[1] > gap[0]], chunk_size, job)
+
+            # 多个文件按相对位置交错排队（各文件的开头优先），音视频的下载进度保持同步
+            scheduler.interleave()
+
+            tracker.start(sum(job.downloaded for job in jobs), sum(job.total_size for job in jobs))
+
+            # 下载协程数量为并发上限，实际并发由控制器决定
+            for _ in range(controller.max_concurrency):
+                tasks.append(asyncio.ensure_future(worker()))
+
+            # 执行所有下载任务
+            await asyncio.gather(*tasks)
+
+            # 下载完成，日志不再需要
+            for job in jobs:
+                await job.writer.flush()
+                job.journal.remove()
+            tracker.finish()
+            return True
+
+        except Exception as e:
+            # 保留已下载的数据和日志，下次下载时从断点继续
+            print(f"\n下载失败: {str(e)}")
+            return False
+
+        finally:
+            # 任一区间失败时取消其余下载，确保关闭文件后不再有写入
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            share.close()
+            # 关闭未被使用的探测请求
+            for seg in scheduler.pending:
+                if seg.prefetched is not None:
+                    seg.prefetched[1].close()
+            for job in jobs:
+                if job.probe is not None:
+                    job.probe[1].close()
+                if job.writer is not None:
+                    try:
+                        await job.journal.flush(job.writer)
+                    finally:
+                        await job.writer.close()
@@ -0,0 +1,469 @@
+import os
+import time
+import heapq
+import queue
+import shutil
+import asyncio
+import tempfile
+import platform
+import threading
+import subprocess
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from ffmpeg_manager import resolve_ffmpeg
+
+
+# 合并进度：已输出的媒体时长（秒）、相对实时的倍速、已写入字节数、预计总字节数、百分比
+MergeProgress = namedtuple('MergeProgress', ['out_time', 'speed', 'size', 'total_size', 'percentage'])
+# 一次合并的记录：输出文件、方式（native/ffmpeg）、用时（秒）、数据量（字节）、吞吐（字节/秒）
+MergeStats = namedtuple('MergeStats', ['output', 'method', 'seconds', 'size', 'throughput'])
+
+
+class FFmpegProcess:
+    """
+    运行 ffmpeg
+    指定进度回调时加上 -progress pipe:1，逐段解析为 MergeProgress；
+    stderr 由后台线程持续读取，只保留最后 stderr_lines 行，长文件也不会在内存中堆积输出
+    """
+
+    stderr_lines = 50
+
+    def __init__(self, cmd, total_size=None, progress_callback=None, **kwargs):
+        self.total_size = total_size
+        self.progress_callback = progress_callback
+        if progress_callback:
+            cmd = cmd[:1] + ['-nostats', '-progress', 'pipe:1'] + cmd[1:]
+        self.stderr = deque(maxlen=self.stderr_lines)
+        self.process = subprocess.Popen(
+            cmd, stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE if progress_callback else subprocess.DEVNULL,
+            stderr=subprocess.PIPE, **kwargs)
+        self._stderr_reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self._stderr_reader.start()
+
+    def _read_stderr(self):
+        for line in self.process.stderr:
+            self.stderr.append(line.decode(errors='replace').rstrip())
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    @property
+    def error_output(self):
+        return '\n'.join(self.stderr)
+
+    def poll(self):
+        return self.process.poll()
+
+    def kill(self):
+        self.process.kill()
+
+    def wait(self):
+        """读取进度直到 ffmpeg 退出，返回退出码"""
+        if self.progress_callback:
+            fields = {}
+            for line in self.process.stdout:
+                key, _, value = line.decode(errors='replace').strip().partition('=')
+                fields[key] = value
+                # 每段进度以 progress=continue/end 结束
+                if key == 'progress':
+                    try:
+                        self.progress_callback(self.parse_progress(fields))
+                    except Exception as e:
+                        print(f"合并进度回调出错: {str(e)}")
+                    fields = {}
+        self.process.wait()
+        self._stderr_reader.join()
+        return self.process.returncode
+
+    def parse_progress(self, fields):
+        out_time = None
+        # out_time_ms 实际也是微秒
+        for key in ('out_time_us', 'out_time_ms'):
+            if fields.get(key, 'N/A').lstrip('-').isdigit():
+                out_time = max(int(fields[key]), 0) / 1000000
+                break
+        speed = None
+        try:
+            speed = float(fields.get('speed', '').rstrip('x'))
+        except ValueError:
+            pass
+        size = int(fields['total_size']) if fields.get('total_size', '').isdigit() else 0
+        percentage = None
+        if fields.get('progress') == 'end':
+            percentage = 100.0
+        elif self.total_size:
+            percentage = min(size / self.total_size * 100, 100.0)
+        return MergeProgress(out_time, speed, size, self.total_size, percentage)
+
+
+def _pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _pread_all(fd, length, offset):
+    chunks = []
+    while length > 0:
+        chunk = os.pread(fd, length, offset)
+        if not chunk:
+            raise OSError("溢出文件被截断")
+        chunks.append(chunk)
+        offset += len(chunk)
+        length -= len(chunk)
+    return b''.join(chunks)
+
+
+class PipeSink(threading.Thread):
+    """
+    把按顺序到达的数据写入命名管道（FIFO）的后台线程
+    打开管道时不阻塞等待读端：ffmpeg 未启动或已退出时放弃，避免线程永久挂起
+    超出内存上限的数据由写入器放在溢出文件中，队列里只有其位置，由本线程等写入完成后读回，
+    内存占用不随文件大小增长，磁盘读写也不在事件循环中进行
+    """
+
+    def __init__(self, path, reader_alive):
+        super().__init__(daemon=True)
+        self.path = path
+        self.reader_alive = reader_alive
+        self.queue = queue.Queue()
+        # 已交给线程但尚未写入管道、保存在内存中的字节数
+        self.queued = 0
+        self.error = None
+        self._lock = threading.Lock()
+
+    def put(self, data):
+        with self._lock:
+            self.queued += len(data)
+        self.queue.put(data)
+
+    def put_spilled(self, position, length, written, read):
+        """
+        送出溢出文件中的数据
+        Args:
+            written: 写入溢出文件的 Future，完成后才能读回
+            read: read(position, length) 从溢出文件读回数据
+        """
+        self.queue.put((position, length, written, read))
+
+    def close(self):
+        self.queue.put(None)
+
+    def _open(self):
+        while True:
+            try:
+                fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+                os.set_blocking(fd, True)
+                return fd
+            except OSError:
+                # 读端尚未打开
+                if not self.reader_alive():
+                    raise Exception("ffmpeg 未读取管道")
+                time.sleep(0.05)
+
+    def run(self):
+        fd = None
+        try:
+            fd = self._open()
+        except Exception as e:
+            self.error = e
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            spilled = isinstance(item, tuple)
+            try:
+                if fd is not None and self.error is None:
+                    if spilled:
+                        position, length, spill_written, read = item
+                        spill_written.result()
+                        data = read(position, length)
+                    else:
+                        data = item
+                    view = memoryview(data)
+                    while view:
+                        written = os.write(fd, view)
+                        view = view[written:]
+            except Exception as e:
+                # ffmpeg 提前退出或溢出文件读写失败，丢弃后续数据
+                self.error = e
+            finally:
+                if not spilled:
+                    with self._lock:
+                        self.queued -= len(item)
+        if fd is not None:
+            os.close(fd)
+
+
+class StreamingWriter:
+    """
+    与 PreallocatedFileWriter 接口相同的写入器，数据不落盘而是按顺序送入管道
+    分段下载的区间乱序到达：连续部分立即送出，超前的部分暂存在重排缓冲区，
+    等前面的空缺补齐后再送出；冗余请求重复写入的部分直接丢弃
+    重排缓冲区和待写入管道的数据合计超过 buffer_limit 后，新数据写入溢出文件（管道路径加 .spill）
+    而不是内存；写入方从不等待，一路流等待另一路流的数据时也不会占住下载并发
+    write_at 中只做 frontier 和重排缓冲区的记账，溢出文件的写入在单独的线程中、读回在 PipeSink 线程中进行
+    """
+
+    # 内存中暂存数据的上限（重排缓冲区 + 待写入管道）
+    buffer_limit = 64 * 1024 * 1024
+
+    def __init__(self, sink, total_size):
+        self.sink = sink
+        self.total_size = total_size
+        # 已送入管道的位置
+        self.frontier = 0
+        # 超前到达的数据：offset -> bytes 或溢出文件中的 (位置, 长度, 写入的 Future)，heap 中为 offset
+        self._pending = {}
+        self._heap = []
+        # 重排缓冲区在内存中的字节数
+        self.buffered = 0
+        self._spill_fd = None
+        self._spill_end = 0
+        self._spill_executor = None
+
+    async def open(self):
+        if not self.sink.is_alive():
+            self.sink.start()
+        return self
+
+    def _over_limit(self, size):
+        return self.buffered + self.sink.queued + size > self.buffer_limit
+
+    async def write_at(self, offset, data):
+        # 整个过程中没有 await：并发的冗余请求不会在检查 frontier 之后、送出之前交错执行
+        end = offset + len(data)
+        if end <= self.frontier:
+            return
+        if offset < self.frontier:
+            data = data[self.frontier - offset:]
+            offset = self.frontier
+        if offset == self.frontier:
+            self._emit(data)
+            self._drain()
+            return
+        existing = self._pending.get(offset)
+        if existing is None:
+            heapq.heappush(self._heap, offset)
+        elif self._length(existing) >= len(data):
+            return
+        elif not isinstance(existing, tuple):
+            self.buffered -= len(existing)
+        if self._over_limit(len(data)):
+            self._pending[offset] = self._spill(data)
+        else:
+            self._pending[offset] = bytes(data)
+            self.buffered += len(data)
+
+    @staticmethod
+    def _length(entry):
+        return entry[1] if isinstance(entry, tuple) else len(entry)
+
+    def _spill(self, data):
+        """分配溢出文件中的位置并提交写入，立即返回 (位置, 长度, 写入的 Future)"""
+        if self._spill_executor is None:
+            self._spill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bili_spill')
+        position = self._spill_end
+        self._spill_end += len(data)
+        return position, len(data), self._spill_executor.submit(self._write_spill, bytes(data), position)
+
+    def _write_spill(self, data, position):
+        # 在溢出线程中执行
+        if self._spill_fd is None:
+            self._spill_fd = os.open(f"{self.sink.path}.spill", os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        _pwrite_all(self._spill_fd, data, position)
+
+    def _read_spill(self, position, length):
+        # 在 PipeSink 线程中执行
+        return _pread_all(self._spill_fd, length, position)
+
+    def _emit(self, entry, skip=0):
+        """按顺序送出 bytes 或溢出文件中的数据，跳过开头已送出的 skip 字节"""
+        if self.sink.error is not None:
+            raise Exception(f"写入 ffmpeg 失败: {self.sink.error}")
+        if isinstance(entry, tuple):
+            position, length, written = entry
+            self.sink.put_spilled(position + skip, length - skip, written, self._read_spill)
+            self.frontier += length - skip
+            return
+        data = entry[skip:] if skip else entry
+        if self._over_limit(len(data)):
+            self._emit(self._spill(data))
+            return
+        self.sink.put(bytes(data))
+        self.frontier += len(data)
+
+    def _drain(self):
+        """送出缓冲区中与已送出部分相连的数据"""
+        while self._heap and self._heap[0] <= self.frontier:
+            offset = heapq.heappop(self._heap)
+            entry = self._pending.pop(offset)
+            if not isinstance(entry, tuple):
+                self.buffered -= len(entry)
+            if offset + self._length(entry) > self.frontier:
+                self._emit(entry, self.frontier - offset)
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        """数据结束（或下载失败），关闭管道写端"""
+        self._pending.clear()
+        self._heap = []
+        self.buffered = 0
+        self.sink.close()
+        loop = asyncio.get_running_loop()
+        if self.sink.is_alive():
+            await loop.run_in_executor(None, self.sink.join)
+        # 管道线程结束后不会再读回溢出文件
+        if self._spill_executor is not None:
+            await loop.run_in_executor(None, self._spill_executor.shutdown)
+            self._spill_executor = None
+        if self._spill_fd is not None:
+            os.close(self._spill_fd)
+            self._spill_fd = None
+
+
+class MuxStage:
+    """
+    后台合并阶段
+    合并任务提交到有并发上限的线程池后立即返回 Future，调用方可以继续下载下一项；
+    实际工作在 ffmpeg 子进程或内核态复制中完成，线程只负责等待结果
+    """
+
+    def __init__(self, merge, concurrency=2):
+        self.merge = merge
+        self.concurrency = concurrency
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, *args):
+        """
+        提交一次合并
+        Returns:
+            concurrent.futures.Future: 结果为 merge 的返回值
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='bili_mux')
+            return self._executor.submit(self.merge, *args)
+
+    async def run(self, *args):
+        """在事件循环中等待一次后台合并"""
+        return await asyncio.wrap_future(self.submit(*args))
+
+    def shutdown(self, wait=True):
+        """等待已提交的合并完成并释放线程池"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+class StreamingMuxer:
+    """
+    边下载边合并
+    视频和音频各通过一个命名管道送入 ffmpeg，最后一个字节到达后几秒内即生成最终文件，
+    不再写入临时的 .mp4/.mp3 文件；不支持命名管道的系统（Windows）上不可用
+    """
+
+    def __init__(self, ffmpeg_path=None):
+        # 未指定时使用 resolve_ffmpeg 找到的FFmpeg
+        self.ffmpeg_path = ffmpeg_path
+
+    @staticmethod
+    def supported():
+        return hasattr(os, 'mkfifo') and platform.system() != 'Windows'
+
+    async def mux(self, engine, video_source, audio_source, output, headers=None, cookies=None,
+                  progress_callback=None):
+        """
+        下载并合并到 output（完整文件名）
+        Returns:
+            bool: 是否成功
+        """
+        ffmpeg_path = self.ffmpeg_path
+        if ffmpeg_path is None:
+            info = resolve_ffmpeg()
+            if info is None:
+                print("合并失败: 未找到FFmpeg")
+                return False
+            ffmpeg_path = info.path
+
+        fifo_dir = tempfile.mkdtemp(prefix='bili_mux_')
+        video_fifo = os.path.join(fifo_dir, 'video')
+        audio_fifo = os.path.join(fifo_dir, 'audio')
+        os.mkfifo(video_fifo)
+        os.mkfifo(audio_fifo)
+
+        cmd = [
+            ffmpeg_path,
+            '-loglevel', 'error',
+            '-i', video_fifo,
+            '-i', audio_fifo,
+            '-map', '0:v:0',
+            '-map', '1:a:0',
+            '-c:v', 'copy',
+            '-c:a', 'copy',
+            '-y',
+            output
+        ]
+        process = None
+        download = None
+        try:
+            process = FFmpegProcess(cmd)
+
+            def reader_alive():
+                return process.poll() is None
+            sinks = {video_fifo: PipeSink(video_fifo, reader_alive), audio_fifo: PipeSink(audio_fifo, reader_alive)}
+
+            def writer_factory(filename, total_size):
+                return StreamingWriter(sinks[filename], total_size)
+
+            loop = asyncio.get_running_loop()
+            download = asyncio.ensure_future(engine.download_many(
+                [(video_source, video_fifo), (audio_source, audio_fifo)],
+                headers, cookies, progress_callback,
+                writer_factory=writer_factory, resumable=False
+            ))
+            ffmpeg = loop.run_in_executor(None, process.wait)
+            await asyncio.wait([download, ffmpeg], return_when=asyncio.FIRST_COMPLETED)
+
+            if not download.done():
+                # ffmpeg 先退出，说明合并失败，停止下载
+                download.cancel()
+                await asyncio.gather(download, return_exceptions=True)
+                await ffmpeg
+                print(f"合并失败: {process.error_output}")
+                return False
+
+            if not download.result():
+                process.kill()
+                await ffmpeg
+                return False
+
+            if await ffmpeg != 0:
+                print(f"合并失败: {process.error_output}")
+                return False
+            return True
+
+        except Exception as e:
+            print(f"合并失败: {str(e)}")
+            return False
+
+        finally:
+            if download is not None and not download.done():
+                download.cancel()
+                await asyncio.gather(download, return_exceptions=True)
+            if process is not None and process.poll() is None:
+                process.kill()
+            if process is not None and process.returncode != 0 and os.path.exists(output):
+                try:
+                    os.remove(output)
+                except Exception as e:
+                    print(f"删除不完整的文件失败: {str(e)}")
+            shutil.rmtree(fifo_dir, ignore_errors=True)
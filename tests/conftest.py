@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import threading
+
+import pytest
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class RangeServer:
+    """
+    在后台线程中运行的本地 HTTP 服务器
+    /files/{name} 支持 Range 请求，可以让指定文件返回 500 或让某个区间在首字节前停顿；
+    其他路径交给 json_routes 中的处理函数，用于模拟接口
+    """
+
+    block_size = 64 * 1024
+
+    def __init__(self):
+        self.files = {}
+        # 返回 500 的文件名
+        self.failing = set()
+        # (文件名, 起始位置) -> 首字节前停顿的秒数，只生效一次
+        self.stalls = {}
+        # 收到的区间请求：(文件名, 起始, 结束)
+        self.requests = []
+        # 已发送的文件字节数
+        self.served = 0
+        # 客户端提前断开的区间请求：(文件名, 起始, 断开时间)
+        self.cancelled = []
+        # 路径 -> handler(query)，返回 (状态码, JSON)
+        self.json_routes = {}
+        self.port = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.port}{path}"
+
+    def file_url(self, name):
+        return self.url(f"/files/{name}")
+
+    async def _handle_file(self, request):
+        name = request.match_info['name']
+        start, _, end = request.headers.get('Range', 'bytes=0-').partition('=')[2].partition('-')
+        start = int(start)
+        if name in self.failing or name not in self.files:
+            self.requests.append((name, start, None))
+            return web.Response(status=500)
+        data = self.files[name]
+        end = min(int(end), len(data) - 1) if end else len(data) - 1
+        self.requests.append((name, start, end + 1))
+        response = web.StreamResponse(status=206, headers={
+            'Content-Range': f'bytes {start}-{end}/{len(data)}',
+            'Content-Length': str(end - start + 1),
+            'ETag': f'"{name}-{len(data)}"'
+        })
+        await response.prepare(request)
+        try:
+            delay = self.stalls.pop((name, start), 0)
+            if delay:
+                await asyncio.sleep(delay)
+            for offset in range(start, end + 1, self.block_size):
+                block = data[offset:min(offset + self.block_size, end + 1)]
+                await response.write(block)
+                self.served += len(block)
+        except asyncio.CancelledError:
+            self.cancelled.append((name, start, time.monotonic()))
+            raise
+        await response.write_eof()
+        return response
+
+    async def _handle_json(self, request):
+        handler = self.json_routes.get(request.path)
+        if handler is None:
+            return web.json_response({'code': -404, 'message': 'not found'}, status=404)
+        status, body = handler(dict(request.query))
+        return web.json_response(body, status=status)
+
+    async def _start(self, sock):
+        app = web.Application()
+        app.router.add_get('/files/{name}', self._handle_file)
+        app.router.add_get('/{path:.*}', self._handle_json)
+        # 客户端断开（如冗余请求被取消）时取消处理函数，停顿中的请求不会拖住关闭
+        self._runner = web.AppRunner(app, handler_cancellation=True)
+        await self._runner.setup()
+        await web.SockSite(self._runner, sock).start()
+
+    def start(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.port = sock.getsockname()[1]
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(sock), self._loop).result(10)
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._loop.close()
+
+
+@pytest.fixture
+def server():
+    srv = RangeServer().start()
+    yield srv
+    srv.stop()
+
+
+@pytest.fixture
+def mirror_server():
+    """第二个服务器（不同端口即不同主机），用于镜像切换"""
+    srv = RangeServer().start()
+    yield srv
+    srv.stop()
@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import subprocess
+
+from range_downloader import (RangeDownloader, StreamSource, ChunkPolicy, RetryPolicy, BandwidthLimiter,
+                              ConcurrencyController)
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KB = 1024
+MB = 1024 * 1024
+
+
+def payload(size, seed=0):
+    return bytes((i * 7 + seed) % 251 for i in range(size))
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def engine(**kwargs):
+    kwargs.setdefault('bandwidth', BandwidthLimiter())
+    kwargs.setdefault('retry_policy', RetryPolicy(max_retries=3, backoff=0, timeout=10))
+    kwargs.setdefault('chunk_policy', ChunkPolicy(chunk_count=8, min_chunk_size=256 * KB, min_split_size=64 * KB))
+    return RangeDownloader(min_concurrency=2, max_concurrency=4, **kwargs)
+
+
+def test_full_download(server, tmp_path):
+    server.files['video'] = payload(3 * MB + 123)
+    server.files['audio'] = payload(700 * KB, seed=3)
+    events = []
+
+    async def main():
+        async with engine() as downloader:
+            return await downloader.download_many(
+                [
+                    # 大小未知，由第一个分块请求的 Content-Range 得到
+                    (server.file_url('video'), str(tmp_path / 'v.mp4')),
+                    # 播放信息中已给出大小
+                    (StreamSource([server.file_url('audio')], len(server.files['audio'])), str(tmp_path / 'a.mp3'))
+                ],
+                progress_callback=events.append
+            )
+
+    assert asyncio.run(main())
+    assert read(tmp_path / 'v.mp4') == server.files['video']
+    assert read(tmp_path / 'a.mp3') == server.files['audio']
+    assert not os.path.exists(tmp_path / 'v.mp4.journal')
+    assert events[-1].downloaded == events[-1].total == 3 * MB + 123 + 700 * KB
+    # 探测请求的响应被第一个区间复用，文件开头不会再请求一遍
+    assert len([r for r in server.requests if r[0] == 'video' and r[1] == 0]) == 1
+    assert len([r for r in server.requests if r[0] == 'audio' and r[1] == 0]) == 1
+
+
+def test_download_sync(server, tmp_path):
+    server.files['file'] = payload(MB)
+    downloader = engine()
+    try:
+        assert downloader.download_sync([(server.file_url('file'), str(tmp_path / 'f'))])
+        # 同步接口复用自己的事件循环和连接池
+        assert downloader.download_sync([(server.file_url('file'), str(tmp_path / 'g'))])
+    finally:
+        downloader.close_sync()
+    assert read(tmp_path / 'f') == read(tmp_path / 'g') == server.files['file']
+
+
+CRASH_SCRIPT = """
+import sys, asyncio
+sys.path.insert(0, sys.argv[1])
+from range_downloader import RangeDownloader, StreamSource, ChunkPolicy, BandwidthLimiter
+
+async def main():
+    downloader = RangeDownloader(2, 4, ChunkPolicy(chunk_count=8, min_chunk_size=256 * 1024),
+                                 bandwidth=BandwidthLimiter(int(sys.argv[4])))
+    await downloader.download_many([(StreamSource([sys.argv[2]], int(sys.argv[5])), sys.argv[3])])
+
+asyncio.run(main())
+"""
+
+
+def test_resume_after_crash(server, tmp_path):
+    data = server.files['file'] = payload(4 * MB)
+    target = str(tmp_path / 'file')
+    journal = f"{target}.journal"
+    process = subprocess.Popen([sys.executable, '-c', CRASH_SCRIPT, REPO, server.file_url('file'), target,
+                                str(MB), str(len(data))])
+    try:
+        # 等日志记录了一部分进度后直接杀掉进程，不给它清理的机会
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            if os.path.exists(journal):
+                with open(journal) as f:
+                    if json.load(f)['completed']:
+                        break
+            time.sleep(0.05)
+        else:
+            raise AssertionError("下载日志没有记录进度")
+    finally:
+        process.kill()
+        process.wait()
+
+    with open(journal) as f:
+        completed_ranges = json.load(f)['completed']
+    completed = sum(end - start for start, end in completed_ranges)
+    assert 0 < completed < len(data)
+
+    server.requests.clear()
+
+    async def main():
+        async with engine(chunk_policy=ChunkPolicy(chunk_count=8, min_chunk_size=256 * KB, hedge=False)) as d:
+            return await d.download_many([(StreamSource([server.file_url('file')], len(data)), target)])
+
+    assert asyncio.run(main())
+    assert read(target) == data
+    # 只请求了日志中缺失的部分
+    assert server.requests
+    for _, start, _ in server.requests:
+        assert not any(done_start <= start < done_end for done_start, done_end in completed_ranges)
+    assert not os.path.exists(journal)
+
+
+def test_unused_probe_is_closed_on_resume(server, tmp_path):
+    data = server.files['file'] = payload(12 * MB)
+    target = tmp_path / 'file'
+    # 上次已下载文件开头 1MB，大小未知时探测请求（从 0 开始）的数据用不上
+    with open(target, 'wb') as f:
+        f.write(data[:MB])
+        f.truncate(len(data))
+    with open(f"{target}.journal", 'w') as f:
+        json.dump({'total_size': len(data), 'etag': f'"file-{len(data)}"', 'last_modified': None,
+                   'completed': [[0, MB]]}, f)
+    server.stalls[('file', 0)] = 30
+
+    async def main():
+        async with engine(bandwidth=BandwidthLimiter(4 * MB)) as downloader:
+            success = await downloader.download_many([(server.file_url('file'), str(target))])
+            return success, time.monotonic()
+
+    success, finished = asyncio.run(main())
+    assert success
+    assert read(target) == data
+    # 探测连接在开始下载缺失区间前就已关闭，而不是一直占用到下载结束
+    probes = [cancelled for name, start, cancelled in server.cancelled if start == 0]
+    assert probes and probes[0] < finished - 1
+    assert not [r for r in server.requests if r[1] < MB and r[1] != 0]
+
+
+def test_resume_rejects_changed_remote_file(server, tmp_path):
+    old = payload(2 * MB)
+    data = server.files['file'] = payload(2 * MB, seed=1)
+    target = tmp_path / 'file'
+    # 日志来自旧版本文件（大小相同、ETag 不同），下载源给出了大小，不会探测
+    with open(target, 'wb') as f:
+        f.write(old[:MB])
+        f.truncate(len(data))
+    with open(f"{target}.journal", 'w') as f:
+        json.dump({'total_size': len(data), 'etag': '"old"', 'last_modified': None, 'completed': [[0, MB]]}, f)
+
+    async def main():
+        async with engine() as downloader:
+            return await downloader.download_many([(StreamSource([server.file_url('file')], len(data)), str(target))])
+
+    # 第一个区间响应的 ETag 与日志不一致，放弃旧进度，不写入旧数据之上
+    assert not asyncio.run(main())
+    with open(f"{target}.journal") as f:
+        state = json.load(f)
+    assert state['etag'] == f'"file-{len(data)}"'
+    server.requests.clear()
+    # 再次下载时旧进度已作废，文件开头重新获取，得到新版本文件
+    assert asyncio.run(main())
+    assert read(target) == data
+    assert any(start < MB for _, start, _ in server.requests)
+
+
+def test_stalled_range_is_split_and_hedged(server, tmp_path):
+    data = server.files['file'] = payload(2 * MB)
+    # 第一个区间的请求在首字节前停顿很久
+    server.stalls[('file', 0)] = 30
+
+    async def main():
+        async with engine() as downloader:
+            return await downloader.download_many(
+                [(StreamSource([server.file_url('file')], len(data)), str(tmp_path / 'file'))])
+
+    started = time.monotonic()
+    assert asyncio.run(main())
+    assert time.monotonic() - started < 10
+    assert read(tmp_path / 'file') == data
+    # 停顿的区间被拆分，剩余部分由冗余请求完成
+    assert len([r for r in server.requests if r[1] == 0]) >= 2
+    assert any(0 < r[1] < 256 * KB for r in server.requests)
+
+
+def test_failing_mirror(server, mirror_server, tmp_path):
+    data = mirror_server.files['file'] = payload(2 * MB)
+    server.failing.add('file')
+
+    async def main():
+        async with engine() as downloader:
+            success = await downloader.download_many(
+                [(StreamSource([server.file_url('file'), mirror_server.file_url('file')], len(data)),
+                  str(tmp_path / 'file'))])
+            bad_host = downloader.hosts.hosts[downloader.hosts.host_of(server.file_url('file'))]
+            return success, bad_host['failures']
+
+    started = time.monotonic()
+    success, failures = asyncio.run(main())
+    assert success
+    assert read(tmp_path / 'file') == data
+    # 失败的主机进入冷却期，之后的区间都从镜像下载，且切换时不等待重试退避
+    assert failures >= 1
+    assert time.monotonic() - started < 5
+    assert server.requests and server.served == 0
+    assert mirror_server.served >= len(data)
+
+
+def test_bandwidth_limit(server, tmp_path):
+    data = server.files['file'] = payload(2 * MB)
+    limiter = BandwidthLimiter(MB)
+
+    async def main():
+        async with engine(bandwidth=limiter) as downloader:
+            return await downloader.download_many(
+                [(StreamSource([server.file_url('file')], len(data)), str(tmp_path / 'file'))])
+
+    started = time.monotonic()
+    assert asyncio.run(main())
+    elapsed = time.monotonic() - started
+    assert read(tmp_path / 'file') == data
+    # 2MB 在 1MB/s 下至少需要约 1.5 秒（允许 0.5 秒的突发）
+    assert 1.4 <= elapsed < 5
+    assert not limiter.shares
+
+
+def test_controller_shared_between_loops():
+    controller = ConcurrencyController(min_concurrency=1, max_concurrency=1, initial_concurrency=1)
+    held = threading.Event()
+    acquired = threading.Event()
+
+    async def hold():
+        async with controller.slot():
+            held.set()
+            await asyncio.sleep(0.2)
+
+    async def wait():
+        held.wait(5)
+        await asyncio.wait_for(controller.acquire(), 5)
+        acquired.set()
+        await controller.release()
+
+    # 另一个线程的事件循环释放名额时，这个循环中等待的请求也会被唤醒
+    thread = threading.Thread(target=asyncio.run, args=(hold(),))
+    thread.start()
+    asyncio.run(wait())
+    thread.join(5)
+    assert acquired.is_set()
+    assert controller.in_flight == 0
+
+
+def test_connector_fits_max_concurrency():
+    async def main():
+        downloader = RangeDownloader(min_concurrency=2, max_concurrency=48)
+        try:
+            return downloader._get_session().connector
+        finally:
+            await downloader.close()
+
+    connector = asyncio.run(main())
+    assert connector.limit_per_host >= 48 and connector.limit >= 48
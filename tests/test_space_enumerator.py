@@ -0,0 +1,191 @@
+import asyncio
+
+import pytest
+
+from bili_api import ApiClient, AsyncApiClient, ApiScheduler, SpaceEnumerator, WbiSigner, BulkResolver
+from range_downloader import RetryPolicy
+
+NAV = {
+    'code': -101,
+    'data': {'wbi_img': {
+        'img_url': 'https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png',
+        'sub_url': 'https://i0.hdslb.com/bfs/wbi/4932caff0ff746eab6f01bf08b70ac45.png'
+    }}
+}
+
+
+@pytest.fixture
+def enumerator(server):
+    """指向本地服务器的 SpaceEnumerator，调度器不限速"""
+    client = ApiClient(retry_policy=RetryPolicy(max_retries=2, backoff=0, timeout=5),
+                       scheduler=ApiScheduler(rate=1000, max_rate=1000, burst=1000))
+    client.wbi.api_nav = server.url('/x/web-interface/nav')
+    server.json_routes['/x/web-interface/nav'] = lambda query: (200, NAV)
+    space = SpaceEnumerator(AsyncApiClient(client), page_size=30)
+    space.api_space = server.url('/x/space/wbi/arc/search')
+    space.api_favorites = server.url('/x/v3/fav/resource/list')
+    space.api_season = server.url('/x/polymer/web-space/seasons_archives_list')
+    return space
+
+
+def collect(space, generator):
+    async def main():
+        result = []
+        try:
+            async for bvid in generator:
+                result.append(bvid)
+        finally:
+            await generator.aclose()
+            await space.client.close()
+        return result
+    return asyncio.run(main())
+
+
+def test_uploader_videos_pages_until_count(server, enumerator):
+    queries = []
+    videos = [f"BV{i:010d}" for i in range(70)]
+
+    def arc_search(query):
+        queries.append(query)
+        pn, ps = int(query['pn']), int(query['ps'])
+        vlist = [{'bvid': bvid} for bvid in videos[(pn - 1) * ps:pn * ps]]
+        return 200, {'code': 0, 'data': {'list': {'vlist': vlist}, 'page': {'pn': pn, 'ps': ps, 'count': 70}}}
+    server.json_routes['/x/space/wbi/arc/search'] = arc_search
+
+    assert collect(enumerator, enumerator.uploader_videos(123)) == videos
+    assert [q['pn'] for q in queries] == ['1', '2', '3']
+    # wbi 接口的每一页都带签名
+    for query in queries:
+        assert query['mid'] == '123'
+        signed = WbiSigner.sign({k: v for k, v in query.items() if k not in ('w_rid', 'wts')},
+                                WbiSigner.get_mixin_key('7cd084941338484aae1ad9425b84077c'
+                                                        '4932caff0ff746eab6f01bf08b70ac45'), query['wts'])
+        assert signed['w_rid'] == query['w_rid']
+
+
+def test_failed_nav_is_not_retried_per_page(server, enumerator):
+    nav_requests = []
+
+    def nav(query):
+        nav_requests.append(query)
+        return 200, {'code': 0, 'data': {}}
+    server.json_routes['/x/web-interface/nav'] = nav
+    queries = []
+
+    def arc_search(query):
+        queries.append(query)
+        pn = int(query['pn'])
+        vlist = [{'bvid': f"BV{pn}"}]
+        return 200, {'code': 0, 'data': {'list': {'vlist': vlist}, 'page': {'pn': pn, 'ps': 1, 'count': 3}}}
+    server.json_routes['/x/space/wbi/arc/search'] = arc_search
+    enumerator.page_size = 1
+
+    assert collect(enumerator, enumerator.uploader_videos(123)) == ['BV1', 'BV2', 'BV3']
+    # 获取密钥失败后在冷却期内直接发送不带签名的请求
+    assert len(nav_requests) == 1
+    assert all('w_rid' not in q for q in queries)
+
+
+def test_favorites_skips_invalid_and_follows_has_more(server, enumerator):
+    pages = {
+        '1': {'medias': [{'bvid': 'BV1', 'attr': 0}, {'bvid': 'BV2', 'attr': 9}, {'bvid': 'BV3', 'attr': 0}],
+              'has_more': True},
+        '2': {'medias': [{'bvid': 'BV4', 'attr': 0}, {'bvid': '', 'attr': 0}], 'has_more': False},
+    }
+    queries = []
+
+    def favorites(query):
+        queries.append(query)
+        return 200, {'code': 0, 'data': pages[query['pn']]}
+    server.json_routes['/x/v3/fav/resource/list'] = favorites
+
+    assert collect(enumerator, enumerator.favorites(42)) == ['BV1', 'BV3', 'BV4']
+    # 收藏夹接口每页最多20条，且不需要签名
+    assert all(q['ps'] == '20' and 'w_rid' not in q for q in queries)
+
+
+def test_season_pages_by_total(server, enumerator):
+    enumerator.page_size = 2
+
+    def season(query):
+        num, size = int(query['page_num']), int(query['page_size'])
+        archives = [{'bvid': f"BV{i}"} for i in range((num - 1) * size, min(num * size, 5))]
+        return 200, {'code': 0, 'data': {'archives': archives,
+                                         'page': {'page_num': num, 'page_size': size, 'total': 5}}}
+    server.json_routes['/x/polymer/web-space/seasons_archives_list'] = season
+
+    assert collect(enumerator, enumerator.season(1, 7)) == [f"BV{i}" for i in range(5)]
+
+
+def test_error_page_ends_enumeration(server, enumerator):
+    def favorites(query):
+        if query['pn'] == '1':
+            return 200, {'code': 0, 'data': {'medias': [{'bvid': 'BV1', 'attr': 0}], 'has_more': True}}
+        return 200, {'code': -400, 'message': '请求错误'}
+    server.json_routes['/x/v3/fav/resource/list'] = favorites
+
+    assert collect(enumerator, enumerator.favorites(42)) == ['BV1']
+
+
+def test_next_page_is_prefetched(server, enumerator):
+    requested = []
+
+    def favorites(query):
+        requested.append(query['pn'])
+        return 200, {'code': 0, 'data': {'medias': [{'bvid': f"BV{query['pn']}", 'attr': 0}],
+                                         'has_more': query['pn'] != '5'}}
+    server.json_routes['/x/v3/fav/resource/list'] = favorites
+
+    async def main():
+        generator = enumerator.favorites(42)
+        first = await generator.__anext__()
+        # 消费第一页时第二页已经在请求中
+        for _ in range(50):
+            if '2' in requested:
+                break
+            await asyncio.sleep(0.02)
+        await generator.aclose()
+        await enumerator.client.close()
+        return first
+
+    assert asyncio.run(main()) == 'BV1'
+    assert '2' in requested
+    # 提前结束时取消预取，不会继续翻页
+    assert '3' not in requested
+
+
+class FakeVideo:
+    """只返回标题和 cid 的视频接口"""
+
+    async def get_info_async(self, bvid):
+        return {'data': {'title': bvid}}
+
+    async def get_cid_async(self, bvid, pages):
+        return 1
+
+    async def get_play_info_async(self, bvid, cid):
+        return {}
+
+
+def test_bulk_resolver_closes_source_on_early_exit(server, enumerator):
+    requested = []
+
+    def favorites(query):
+        requested.append(query['pn'])
+        return 200, {'code': 0, 'data': {'medias': [{'bvid': f"BV1{query['pn']}xxxxxxxx", 'attr': 0}],
+                                         'has_more': True}}
+    server.json_routes['/x/v3/fav/resource/list'] = favorites
+
+    async def main():
+        source = enumerator.favorites(42)
+        results = BulkResolver(FakeVideo(), concurrency=1).resolve(source)
+        first = await results.__anext__()
+        await results.aclose()
+        # 来源随之关闭，后台预取的下一页也被取消
+        assert source.ag_frame is None
+        await asyncio.sleep(0.2)
+        await enumerator.client.close()
+        return first
+
+    assert asyncio.run(main()).error is None
+    assert '3' not in requested
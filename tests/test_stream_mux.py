@@ -0,0 +1,42 @@
+import random
+import asyncio
+import threading
+
+import stream_mux
+from stream_mux import PipeSink, StreamingWriter
+
+
+def test_streaming_writer_reorders_and_spills_off_loop(tmp_path, monkeypatch):
+    data = random.Random(0).randbytes(2 * 1024 * 1024)
+    blocks = [(offset, data[offset:offset + 32 * 1024]) for offset in range(0, len(data), 32 * 1024)]
+    random.Random(1).shuffle(blocks)
+    # 冗余请求重复写入的部分
+    blocks += blocks[:8]
+    path = tmp_path / 'pipe'
+    path.touch()
+
+    disk_threads = set()
+    for name in ('_pwrite_all', '_pread_all'):
+        original = getattr(stream_mux, name)
+
+        def recorded(*args, original=original):
+            disk_threads.add(threading.current_thread())
+            return original(*args)
+        monkeypatch.setattr(stream_mux, name, recorded)
+
+    async def main():
+        # 普通文件代替命名管道；内存上限很小，大部分数据经过溢出文件
+        writer = StreamingWriter(PipeSink(str(path), lambda: True), len(data))
+        writer.buffer_limit = 256 * 1024
+        await writer.open()
+        for offset, block in blocks:
+            await writer.write_at(offset, block)
+            assert writer.buffered <= writer.buffer_limit
+        await writer.close()
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(main())
+    assert path.read_bytes() == data
+    # 溢出文件确实被使用，且读写都不在事件循环线程中
+    assert (tmp_path / 'pipe.spill').exists()
+    assert disk_threads and loop_thread not in disk_threads